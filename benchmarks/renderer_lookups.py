@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark for CachedRenderer field lookups.
+
+Compares the current render-context tracker against the previous
+inspect.stack() based dependency capture. Run from the repository root:
+
+    python -m benchmarks.renderer_lookups
+"""
+import inspect
+import re
+import timeit
+
+from pythonbits.submission import CachedRenderer, re_frender
+
+NUM_FIELDS = 50
+REPEAT = 20  # lookups per field, all but the first one are cache hits
+DEPTH = 10  # extra stack frames between caller and lookup, like in bb.py
+# field names may only contain lowercase letters and underscores
+LEAVES = ['leaf_' + ''.join(chr(ord('a') + int(d)) for d in str(i))
+          for i in range(NUM_FIELDS)]
+
+
+class LegacyRenderer(object):
+    """CachedRenderer.__getitem__ as it was before the render stack"""
+    def __init__(self, **kwargs):
+        self.fields = kwargs
+        self.depends_on = {}
+
+    def __getitem__(self, field):
+        try:
+            caller = next(level[3] for level in inspect.stack()
+                          if level[3].startswith('_render_'))
+        except StopIteration:
+            pass
+        else:
+            caller, n = re.subn(re_frender, '', caller, count=1)
+            if n:
+                self.depends_on[field] = self.depends_on.setdefault(
+                    field, set()) | {caller}
+
+        try:
+            return self.fields[field]
+        except KeyError:
+            rv = getattr(self, '_render_' + field)()
+            self.fields[field] = rv
+            return rv
+
+
+def make_renderer(base):
+    def nested(self, depth):
+        if depth:
+            return nested(self, depth - 1)
+        return [self[leaf] for _ in range(REPEAT) for leaf in LEAVES]
+
+    def _render_top(self):
+        return nested(self, DEPTH)
+
+    attrs = {'_render_top': _render_top}
+    for i, leaf in enumerate(LEAVES):
+        attrs['_render_' + leaf] = lambda self, i=i: i
+    return type(base.__name__ + 'Bench', (base,), attrs)
+
+
+def lookups_per_second(cls, number):
+    def run():
+        r = cls()
+        r['top']
+    seconds = min(timeit.repeat(run, number=number, repeat=3))
+    return number * (NUM_FIELDS * REPEAT + 1) / seconds
+
+
+def main():
+    legacy = lookups_per_second(make_renderer(LegacyRenderer), 1)
+    current = lookups_per_second(make_renderer(CachedRenderer), 100)
+    print("inspect.stack() tracking: {:>12,.0f} lookups/s".format(legacy))
+    print("render stack tracking:    {:>12,.0f} lookups/s".format(current))
+    print("speedup:                  {:>12.1f}x".format(current / legacy))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for taking screenshots of local media files.
+
+Compares taking all screenshots with a single ffmpeg process against one
+ffmpeg process per screenshot. Run from the repository root:
+
+    python -m benchmarks.screenshots [-n NUM_SCREENSHOTS] FILE [FILE ...]
+
+The first run of a file also warms the page cache. To compare cold reads,
+e.g. from a HDD, drop the caches between runs and use --repeat 1.
+"""
+import argparse
+import shutil
+import time
+
+from pythonbits.ffmpeg import FFMpeg, probe
+
+
+def seconds(path, info, num_screenshots, single_process):
+    ffmpeg = FFMpeg(path, info)
+    try:
+        start = time.perf_counter()
+        ffmpeg.take_screenshots(num_screenshots,
+                                single_process=single_process)
+        return time.perf_counter() - start
+    finally:
+        shutil.rmtree(ffmpeg.tempdir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('files', nargs='+', metavar='FILE')
+    parser.add_argument('-n', '--num-screenshots', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    for path in args.files:
+        info = probe(path)
+        times = {}
+        for single_process in (False, True):
+            times[single_process] = min(
+                seconds(path, info, args.num_screenshots, single_process)
+                for _ in range(args.repeat))
+        print(path)
+        print("  one process per screenshot: {:>8.2f}s".format(times[False]))
+        print("  single process:             {:>8.2f}s".format(times[True]))
+        print("  speedup:                    {:>8.1f}x".format(
+            times[False] / times[True]))
+
+
+if __name__ == '__main__':
+    main()
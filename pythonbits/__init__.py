@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import threading
 
 __title__ = "pythonBits"
 __version__ = "3.1b2"
@@ -10,3 +11,7 @@ _release = __title__ + " " + __version__
 _github = 'https://github.com/' + __maintainer__ + '/' + __title__
 
 flags = set()
+
+# held while asking the user for input, so that prompts from concurrently
+# running threads do not interleave
+prompt_lock = threading.RLock()
@@ -5,7 +5,9 @@ from argparse import ArgumentParser
 from . import __version__ as version, flags
 from . import bb
 from . import logging
-from .submission import SubmissionAttributeError, cat_map
+from .cache import FieldCache, Timings, fingerprint
+from .journal import Journal, resume
+from .submission import FinalizationError, cat_map
 
 
 def parse_args():
@@ -69,6 +71,23 @@ def parse_args():
     options_d = {
         'num_screenshots': {'type': int, 'default': 2,
                             'help': "Number of screenshots"},
+        'screenshot_candidates': {'type': int, 'default': 4,
+                                  'help': "Number of frames per screenshot "
+                                          "to pick the sharpest from, if "
+                                          "NumPy is installed"},
+        'contact_sheet': {'type': int, 'default': 0,
+                          'help': "Number of thumbnails on a single contact "
+                                  "sheet to upload instead of the "
+                                  "screenshots, 0 for none (requires NumPy)"},
+        'analyse_screenshots': {'action': 'store_true', 'default': False,
+                                'help': "Choose screenshot times from a "
+                                        "low resolution pass over the "
+                                        "whole video (requires NumPy)"},
+        'keyframe_screenshots': {'action': 'store_true', 'default': False,
+                                 'help': "Take screenshots at the nearest "
+                                         "keyframes, which reads the whole "
+                                         "video once but makes seeking "
+                                         "faster"},
         'num_cast': {'type': int, 'default': 10,
                      'help': "Number of actors to use in tags"},
         'num_directors': {'type': int, 'default': 2,
@@ -76,8 +95,26 @@ def parse_args():
         'data_method': {'type': str, 'default': 'auto',
                         'choices': ['hard', 'sym', 'copy', 'move'],
                         'help': "Data method to use for placing media files"},
+        'jobs': {'type': int, 'default': 1,
+                 'help': "Number of fields to render concurrently"},
+        'max_memory': {'type': int, 'default': 512,
+                       'help': "Soft limit in MiB on memory held by "
+                               "intermediate fields"},
         'headless': {'action': 'store_true', 'default': False,
                      'help': 'Skip user interaction if possible or exit'},
+        'cache': {'action': 'store_true', 'default': False,
+                  'help': 'Reuse fields rendered by previous runs on '
+                          'unchanged media'},
+        'plan': {'action': 'store_true', 'default': False,
+                 'help': 'Only show what would be rendered and finalized, '
+                         'with estimated costs'},
+        'resume': {'action': 'store_true', 'default': False,
+                   'help': 'Continue an interrupted run on the same media '
+                           'from its last checkpoint'},
+        'speculate': {'action': 'store_true', 'default': False,
+                      'help': 'Start finalization steps that can be '
+                              'discarded in the background while the '
+                              'preview is shown'},
     }
 
     options = parser.add_argument_group(
@@ -99,6 +136,18 @@ def parse_args():
     if headless:
         flags.add('headless')
 
+    if args.options.pop('cache'):
+        flags.add('cache')
+
+    if args.options.pop('speculate'):
+        flags.add('speculate')
+
+    if args.options.pop('resume'):
+        flags.add('resume')
+
+    if args.options.pop('plan'):
+        flags.add('plan')
+
     set_field = dict(args.set_field)
 
     Category = cat_map.get(args.category, bb.BbSubmission)
@@ -111,37 +160,73 @@ def parse_args():
     return Category, set_field, get_field
 
 
-def _main(Category, set_fields, get_fields):
+def _plan(Category, set_fields, get_fields, timings):
     sub = Category(**set_fields)
+    sub.timings = timings
+    sub = sub.resolve_category()
+    print(sub.show_plan(get_fields))
+
+
+def _main(Category, set_fields, get_fields, timings):
+    if 'plan' in flags:
+        return _plan(Category, set_fields, get_fields, timings)
+
+    journal = Journal.for_media(set_fields['path'])
+    sub = resume(journal) if 'resume' in flags else None
+    if sub is None:
+        journal.clear()
+        sub = Category(**set_fields)
+        sub.journal = journal
+        sub.checkpoint('start', Category, set_fields,
+                       fingerprint(set_fields['path']))
+
+    if 'cache' in flags:
+        sub.field_cache = FieldCache()
+    sub.timings = timings
+    sub.memory_budget = set_fields['options']['max_memory'] * 2**20
+    jobs = set_fields['options'].get('jobs', 1)
+    headless = 'headless' in flags
 
-    while True:
-        try:
-            sub.show_fields(get_fields)
-        except SubmissionAttributeError as e:
-            logging.log.debug(type(e).__name__ + ': ' + str(e))
-            _sub = sub.subcategorise()
-            if type(_sub) == type(sub):
-                raise
-            sub = _sub
-        else:
-            break
+    sub = sub.resolve_category()
+    if not headless:
+        # ask all questions before the long running work starts
+        sub.render_interactive(get_fields)
+    if jobs > 1:
+        sub.render_concurrently(get_fields, jobs)
+    sub.show_fields(get_fields)
 
-    headless = 'headless' in flags
     if sub.needs_finalization():
+        if 'speculate' in flags and not headless:
+            sub.speculate()
         if headless or sub.confirm_finalization(get_fields):
-            sub.finalize()
+            while True:
+                try:
+                    sub.finalize()
+                except FinalizationError as e:
+                    print(e)
+                    if headless or input('Retry failed finalizations? '
+                                         '[y/N] ').lower() != 'y':
+                        raise
+                else:
+                    break
         else:
             return
 
     print(sub.show_fields(get_fields))
+    journal.clear()
 
 
 def main():
     Category, set_fields, get_fields = parse_args()
+    timings = Timings()
     with logging.log.catch_exceptions(
             "An exception occured.\nFull log stored at file://{}",
             logging.LOG_FILE):
-        _main(Category, set_fields, get_fields)
+        try:
+            _main(Category, set_fields, get_fields, timings)
+        finally:
+            # stored once per run rather than once per rendered field
+            timings.flush()
 
 
 if __name__ == '__main__':
@@ -3,15 +3,12 @@ import os
 import sys
 import shutil
 import re
-import subprocess
 
 from textwrap import dedent
 from collections import namedtuple, abc
 from concurrent.futures.thread import ThreadPoolExecutor
 from datetime import timedelta
-from mimetypes import guess_type
 
-import pymediainfo
 import mutagen
 import guessit
 from unidecode import unidecode
@@ -19,15 +16,19 @@ from requests.exceptions import HTTPError
 
 from .config import config
 from .logging import log
-from .torrent import make_torrent
+from .torrent import make_torrent, get_size
 from . import tvdb
 from . import imdb
 from . import musicbrainz as mb
 from . import imagehosting
-from .ffmpeg import FFMpeg
+from . import mediainfo
+from . import files
+from . import disc
+from . import ffmpeg
 from . import templating as bb
-from .submission import (Submission, form_field, finalize, cat_map,
-                         SubmissionAttributeError, rlinput)
+from .submission import (Submission, form_field, finalize, persistent,
+                         interactive, cost, requires, cat_map,
+                         SubmissionAttributeError, rlinput, prompt_lock)
 from .tracker import Tracker
 from .scene import is_scene_crc, query_scene_fname
 
@@ -57,6 +58,7 @@ def uniq(seq):
 
 class BbSubmission(Submission):
     default_fields = ("form_title", "tags", "cover")
+    _cache_key_fields = ('path',)
 
     def show_fields(self, fields):
         return super(BbSubmission, self).show_fields(
@@ -66,22 +68,22 @@ class BbSubmission(Submission):
         return super(BbSubmission, self).confirm_finalization(
             fields or self.default_fields)
 
-    def subcategory(self):
-        path = self['path']
-        if os.path.isfile(path):
-            files = [(os.path.getsize(path), path)]
-        else:
-            files = []
+    def render_concurrently(self, fields, max_workers=None):
+        return super(BbSubmission, self).render_concurrently(
+            fields or self.default_fields, max_workers)
+
+    def render_interactive(self, fields):
+        return super(BbSubmission, self).render_interactive(
+            fields or self.default_fields)
 
-        for root, _, fs in os.walk(path):
-            for f in fs:
-                fpath = os.path.join(root, f)
-                files.append((os.path.getsize(fpath), fpath))
+    def show_plan(self, fields):
+        return super(BbSubmission, self).show_plan(
+            fields or self.default_fields)
 
-        for _, path in sorted(files, reverse=True):
-            mime_guess, _ = guess_type(path)
-            if mime_guess:
-                mime_guess = mime_guess.split('/')
+    def subcategory(self):
+        for f in sorted(self['files'], key=lambda f: f.size, reverse=True):
+            if f.mime:
+                mime_guess = f.mime.split('/')
                 if mime_guess[0] == 'video':
                     return VideoSubmission
                 elif mime_guess[0] == 'audio':
@@ -106,15 +108,41 @@ class BbSubmission(Submission):
         log.info("Narrowing category from {} to {}",
                  type(self).__name__, SubCategory.__name__)
         sub = SubCategory(**self.fields)
-        sub.depends_on = self.depends_on
+        for attr in ('depends_on', 'field_cache', 'journal', 'timings',
+                     'memory_budget', '_sizes'):
+            setattr(sub, attr, getattr(self, attr))
+        sub.checkpoint('category', SubCategory)
         return sub
 
+    def resolve_category(self):
+        """Narrows the category as far as possible up front. Each step only
+        uses what the previous ones rendered (e.g. a single file scan and a
+        single guessit pass), instead of waiting for a field of the final
+        category to be missing."""
+        sub = self
+        while True:
+            _sub = sub.subcategorise()
+            if _sub is sub:
+                return sub
+            sub = _sub
+
+    @requires('path')
+    def _render_files(self):
+        # shared by everything that looks at the files of the release
+        return files.scan(self['path'])
+
     @staticmethod
     def submit(payload):
         t = Tracker()
         return t.upload(**payload)
 
+    @persistent
     @form_field('scene', 'checkbox')
+    @requires('path')
+    @interactive(when=lambda self: not os.path.isfile(self['path']))
+    @cost(reads=lambda fields: (os.path.getsize(fields['path'])
+                                if os.path.isfile(fields['path']) else 0),
+          http=1)
     def _render_scene(self):
         # todo: if path is directory, choose file for crc
         path = os.path.normpath(self['path'])  # removes trailing slash
@@ -129,13 +157,42 @@ class BbSubmission(Submission):
         except HTTPError as e:
             log.notice(e)
 
-        while True:
-            choice = input('Is this a scene release? [y/N] ')
+        with prompt_lock:
+            while True:
+                choice = input('Is this a scene release? [y/N] ')
+
+                if not choice or choice.lower() == 'n':
+                    return False
+                elif choice.lower() == 'y':
+                    return True
+
+    @persistent
+    @requires('mediainfo_path')
+    def _render_parsed_mediainfo(self):
+        # a single parse for both the text report and the tracks
+        try:
+            return mediainfo.parse(self['mediainfo_path'])
+        except OSError as e:
+            log.debug(e)
+            sys.stderr.write(
+                "Error: Media Info not installed, refer to "
+                "http://mediainfo.sourceforge.net/en for installation")
+            exit(1)
 
-            if not choice or choice.lower() == 'n':
-                return False
-            elif choice.lower() == 'y':
-                return True
+    @persistent
+    @requires('mediainfo_path', 'parsed_mediainfo')
+    def _render_mediainfo(self):
+        mi, _ = self['parsed_mediainfo']
+
+        # Replace absolute path with file name
+        mi_dir = os.path.dirname(self['mediainfo_path']) + os.sep
+        mi = mi.replace(mi_dir, '')
+
+        # bB's mediainfo parser expects "Xbps" instead of "Xb/s"
+        mi = mi.replace('Kb/s', 'Kbps') \
+               .replace('kb/s', 'Kbps') \
+               .replace('Mb/s', 'Mbps')
+        return mi
 
     def data_method(self, source, target):
         def copy(source, target):
@@ -191,8 +248,13 @@ class BbSubmission(Submission):
 
     @finalize
     @form_field('file_input', 'file')
+    @requires('path', 'files')
+    @cost(reads=lambda fields: files.total_size(fields['files'])
+          if 'files' in fields else get_size(fields['path']),
+          subprocesses=2)
     def _render_torrentfile(self):
-        return make_torrent(self['path'])
+        return make_torrent(self['path'],
+                            files.total_size(self['files']))
 
     def _finalize_torrentfile(self):
         # move data to upload directory
@@ -247,6 +309,8 @@ TvSpecifier = namedtuple('TvSpecifier', ['title', 'season', 'episode'])
 class VideoSubmission(BbSubmission):
     default_fields = BbSubmission.default_fields
 
+    @persistent
+    @requires('path')
     def _render_guess(self):
         return dict(guessit.guessit(self['path']))
 
@@ -258,6 +322,7 @@ class VideoSubmission(BbSubmission):
                 return MovieSubmission
         return type(self)
 
+    @requires('summary')
     def _render_title(self):
         # Use format "<original title> AKA <english title>" where applicable
         title_original = self['summary']['title']
@@ -267,6 +332,7 @@ class VideoSubmission(BbSubmission):
         else:
             return title_original
 
+    @requires('title_arg', 'guess')
     def _render_tv_specifier(self):
         # if title is specified, look if season/episode are set
         if self['title_arg']:
@@ -295,6 +361,7 @@ class VideoSubmission(BbSubmission):
             return TvSpecifier(title, season, guess.get('episode'))
 
     @form_field('tags')
+    @requires('options', 'summary')
     def _render_tags(self):
         # todo: get episode-specific actors (from imdb?)
 
@@ -321,86 +388,152 @@ class VideoSubmission(BbSubmission):
             del tags[-1]
         return tags_string(tags)
 
+    @requires('files')
+    def _render_main_feature(self):
+        return disc.main_feature(self['files'])
+
+    @requires('path', 'files', 'main_feature')
+    @interactive(when=lambda self: (not os.path.isfile(self['path']) and
+                                    not self['main_feature']))
     def _render_mediainfo_path(self):
         assert os.path.exists(self['path'])
         if os.path.isfile(self['path']):
             return self['path']
 
-        contained_files = []
-        for dp, dns, fns in os.walk(self['path']):
-            contained_files += [os.path.join(dp, fn) for fn in fns
-                                if (os.path.getsize(os.path.join(dp, fn))
-                                    > 10 * 2**20)]
+        feature = self['main_feature']
+        if feature:
+            # the main clip, instead of asking which segment to analyse
+            sizes = {f.path: f.size for f in self['files']}
+            return max(feature.clips, key=sizes.get)
+
+        contained_files = [f.path for f in self['files']
+                           if f.size > 10 * 2**20]
         if len(contained_files) == 1:
             return contained_files[0]
 
-        print("\nWhich file would you like to run mediainfo on? Choices are")
-        contained_files.sort()
-        for k, v in enumerate(contained_files):
-            print("{}: {}".format(k, os.path.relpath(v, self['path'])))
-        while True:
-            try:
-                choice = input(
-                    "Enter [0-{}]: ".format(len(contained_files) - 1))
-                return contained_files[int(choice)]
-            except (ValueError, IndexError):
-                pass
+        path = self['path']
+        with prompt_lock:
+            print("\nWhich file would you like to run mediainfo on? "
+                  "Choices are")
+            for k, v in enumerate(contained_files):
+                print("{}: {}".format(k, os.path.relpath(v, path)))
+            while True:
+                try:
+                    choice = input(
+                        "Enter [0-{}]: ".format(len(contained_files) - 1))
+                    return contained_files[int(choice)]
+                except (ValueError, IndexError):
+                    pass
+
+    @persistent
+    @requires('mediainfo_path')
+    @cost(subprocesses=1)
+    def _render_probe(self):
+        return ffmpeg.probe(self['mediainfo_path'])
+
+    @persistent
+    @requires('options', 'mediainfo_path', 'probe')
+    @cost(subprocesses=lambda fields:
+          int(fields['options']['analyse_screenshots']))
+    def _render_screenshot_times(self):
+        # None takes the screenshots at fixed stops
+        if not self['options']['analyse_screenshots']:
+            return None
+        if ffmpeg.numpy is None:
+            log.notice('Install NumPy to analyse the video for screenshots')
+            return None
+
+        ff = ffmpeg.FFMpeg(self['mediainfo_path'], self['probe'])
+        try:
+            return ff.plan_screenshots(self['options']['num_screenshots'])
+        except ffmpeg.FfmpegException as e:
+            log.notice('{}, taking screenshots at fixed stops', e)
+            return None
+
+    @persistent
+    @requires('options', 'mediainfo_path')
+    @cost(reads=lambda fields: (
+        os.path.getsize(fields['mediainfo_path'])
+        if fields['options']['keyframe_screenshots'] else 0),
+          subprocesses=lambda fields:
+          int(fields['options']['keyframe_screenshots']))
+    def _render_keyframes(self):
+        # None seeks to the exact screenshot times
+        if not self['options']['keyframe_screenshots']:
+            return None
+        try:
+            return ffmpeg.keyframes(self['mediainfo_path'])
+        except (OSError, ffmpeg.FfmpegException) as e:
+            log.notice('Could not list keyframes: {}', e)
+            return None
+
+    @requires('options', 'mediainfo_path', 'probe')
+    @cost(subprocesses=lambda fields:
+          2 * bool(fields['options']['contact_sheet']))
+    def _render_contact_sheet(self):
+        # None if separate screenshots are taken
+        num = self['options']['contact_sheet']
+        if not num:
+            return None
+        if ffmpeg.numpy is None:
+            log.notice('Install NumPy to make contact sheets')
+            return None
+
+        ff = ffmpeg.FFMpeg(self['mediainfo_path'], self['probe'])
+        try:
+            return ff.make_contact_sheet(num)
+        except ffmpeg.FfmpegException as e:
+            log.notice('{}, taking screenshots instead', e)
+            return None
 
     @finalize
+    @requires('options', 'mediainfo_path', 'probe', 'screenshot_times',
+              'keyframes', 'contact_sheet')
+    @cost(subprocesses=lambda fields:
+          1 + (fields['options']['screenshot_candidates'] > 1) +
+          fields['options']['num_screenshots'])
     def _render_screenshots(self):
-        ns = self['options']['num_screenshots']
-        ffmpeg = FFMpeg(self['mediainfo_path'])
-        return ffmpeg.take_screenshots(ns)
-
-    def _finalize_screenshots(self):
-        return imagehosting.upload(*self['screenshots'])
-
-    def _render_mediainfo(self):
-        try:
-            path = self['mediainfo_path']
-            if os.name == "nt":
-                mi = subprocess.Popen([r"mediainfo", path], shell=True,
-                                      stdout=subprocess.PIPE
-                                      ).communicate()[0].decode('utf8')
-            else:
-                mi = subprocess.Popen([r"mediainfo", path],
-                                      stdout=subprocess.PIPE
-                                      ).communicate()[0].decode('utf8')
-        except OSError:
-            sys.stderr.write(
-                "Error: Media Info not installed, refer to "
-                "http://mediainfo.sourceforge.net/en for installation")
-            exit(1)
+        # the contact sheet replaces the screenshots, e.g. in the description
+        if self['contact_sheet']:
+            screenshots = [self['contact_sheet']]
         else:
-            # Replace absolute path with file name
-            mi_dir = os.path.dirname(self['mediainfo_path']) + '/'
-            mi = mi.replace(mi_dir, '')
-
-            # bB's mediainfo parser expects "Xbps" instead of "Xb/s"
-            mi = mi.replace('Kb/s', 'Kbps') \
-                   .replace('kb/s', 'Kbps') \
-                   .replace('Mb/s', 'Mbps')
-            return mi
+            ns = self['options']['num_screenshots']
+            ff = ffmpeg.FFMpeg(self['mediainfo_path'], self['probe'])
+            screenshots = ff.take_screenshots(
+                ns, keyframes=self['keyframes'],
+                candidates=self['options']['screenshot_candidates'],
+                seeks=self['screenshot_times'])
+
+        # recompressed before the preview, so that uploading can start
+        # right after confirmation
+        ffmpeg.optimise_pngs(screenshots)
+        return screenshots
+
+    @cost(http=lambda fields: fields['options']['num_screenshots'])
+    def _finalize_screenshots(self):
+        return imagehosting.upload_stream(self['screenshots'])
 
+    @persistent
+    @requires('parsed_mediainfo')
     def _render_tracks(self):
         video_tracks = []
         audio_tracks = []
         text_tracks = []
         general = None
 
-        mi = pymediainfo.MediaInfo.parse(self['mediainfo_path'])
-
-        for track in mi.tracks:
-            if track.track_type == 'General':
-                general = track.to_data()
-            elif track.track_type == 'Video':
-                video_tracks.append(track.to_data())
-            elif track.track_type == 'Audio':
-                audio_tracks.append(track.to_data())
-            elif track.track_type == 'Text':
-                text_tracks.append(track.to_data())
+        _, tracks = self['parsed_mediainfo']
+
+        for track in tracks:
+            if track['track_type'] == 'General':
+                general = track
+            elif track['track_type'] == 'Video':
+                video_tracks.append(track)
+            elif track['track_type'] == 'Audio':
+                audio_tracks.append(track)
+            elif track['track_type'] == 'Text':
+                text_tracks.append(track)
             else:
-                log.debug("Unknown track {}", track)
+                log.debug("Unknown track {}", track['track_type'])
 
         assert general is not None
         assert len(video_tracks) == 1
@@ -413,6 +546,8 @@ class VideoSubmission(BbSubmission):
                 'audio': audio_tracks,
                 'text': text_tracks}
 
+    @requires('path')
+    @interactive()
     def _render_source(self):
         sources = ('BluRay', 'BluRay 3D', 'WEB-DL',
                    'WebRip', 'HDTV', 'DVDRip', 'DVDSCR', 'CAM')
@@ -434,15 +569,18 @@ class VideoSubmission(BbSubmission):
         # elif 'dvdscr' in self['path'].lower():
         #    markers['source'] = 'DVDSCR'
         else:
-            print("File:", self['path'])
-            print("Choices:", format_choices(sources))
-            while True:
-                choice = input("Please specify a source by number: ")
-                try:
-                    return sources[int(choice)]
-                except (ValueError, IndexError):
-                    print("Please enter a valid choice")
-
+            path = self['path']
+            with prompt_lock:
+                print("File:", path)
+                print("Choices:", format_choices(sources))
+                while True:
+                    choice = input("Please specify a source by number: ")
+                    try:
+                        return sources[int(choice)]
+                    except (ValueError, IndexError):
+                        print("Please enter a valid choice")
+
+    @requires('tracks')
     def _render_container(self):
         general = self['tracks']['general']
         if general['format'] == 'Matroska':
@@ -453,10 +591,13 @@ class VideoSubmission(BbSubmission):
             return 'MP4'
         elif general['format'] == 'BDAV':
             return 'm2ts'
+        elif general['format'] == 'MPEG-PS':
+            return 'VOB IFO'
         else:
             raise RuntimeError("Unknown or unsupported container '{}'".format(
                 general.format))
 
+    @requires('tracks')
     def _render_video_codec(self):
         video_track = self['tracks']['video']
         codec_id = video_track['codec_id']
@@ -501,6 +642,7 @@ class VideoSubmission(BbSubmission):
                         video_track.get('writing_library'))
         raise RuntimeError(msg)
 
+    @requires('tracks')
     def _render_audio_codec(self):
         audio_track = self['tracks']['audio'][0]  # main audio track
         if audio_track.get('codec_id_hint') == 'MP3':
@@ -533,18 +675,38 @@ class VideoSubmission(BbSubmission):
         raise ValueError("Unknown or unsupported audio codec '{}'".format(
             audio_track['codec_id']))
 
-    def _render_resolution(self):
-        resolutions = ('2160p', '1080p', '720p', '1080i', '720i',
-                       '480p', '480i', 'SD')
+    resolutions = ('2160p', '1080p', '720p', '1080i', '720i',
+                   '480p', '480i', 'SD')
 
+    @classmethod
+    def path_resolution(cls, path):
+        """Resolution named in a path, or None"""
         # todo: replace with regex?
-        # todo: compare result with mediainfo
-        for res in resolutions:
-            if res.lower() in self['path'].lower():
+        for res in cls.resolutions:
+            if res.lower() in path.lower():
                 # warning: 'sd' might match any ol' title, but it's last anyway
                 return res
-        else:
-            print("File:", self['path'])
+
+    @requires('path')
+    # only asks if ffprobe is missing, an unreadable video still asks when
+    # the field is rendered
+    @interactive(when=lambda self: (
+        not self.path_resolution(self['path']) and
+        not shutil.which('ffprobe')))
+    def _render_resolution(self):
+        res = self.path_resolution(self['path'])
+        if res:
+            return res
+
+        try:
+            return self.probed_resolution(ffmpeg.video_stream(self['probe']))
+        except (OSError, ffmpeg.FfmpegException) as e:
+            log.notice('Could not determine resolution: {}', e)
+
+        path = self['path']
+        resolutions = self.resolutions
+        with prompt_lock:
+            print("File:", path)
             print("Choices:", format_choices(resolutions))
             while True:
                 choice = input("Please specify a resolution by number: ")
@@ -552,8 +714,24 @@ class VideoSubmission(BbSubmission):
                     return resolutions[int(choice)]
                 except (ValueError, IndexError):
                     print("Please enter a valid choice")
-        # from mediainfo and filename
 
+    @staticmethod
+    def probed_resolution(stream):
+        """Resolution of a video stream, allowing for cropped frames"""
+        width, height = stream['width'], stream['height']
+        scan = 'i' if stream.get('field_order') in (
+            'tt', 'bb', 'tb', 'bt') else 'p'
+        if width >= 3800 or height >= 2100:
+            return '2160p'
+        elif width >= 1900 or height >= 1040:
+            return '1080' + scan
+        elif width >= 1260 or height >= 700:
+            return '720' + scan
+        elif height in (480, 486):
+            return '480' + scan
+        return 'SD'
+
+    @requires('path', 'guess', 'tracks')
     def _render_additional(self):
         additional = []
         video_track = self['tracks']['video']
@@ -591,14 +769,17 @@ class VideoSubmission(BbSubmission):
 
         return additional
 
+    @requires('additional')
     def _render_form_release_info(self):
         return " / ".join(self['additional'])
 
     @finalize
     @form_field('image')
+    @requires('summary')
     def _render_cover(self):
         return self['summary']['cover']
 
+    @cost(http=1)
     def _finalize_cover(self):
         return imagehosting.upload(self['cover'])
 
@@ -616,10 +797,13 @@ class TvSubmission(VideoSubmission):
     def season(self):
         return self['tv_specifier'].season
 
+    @persistent
+    @requires('path')
     def _render_guess(self):
         return dict(guessit.guessit(self['path'],
                                     options=('--type', 'episode')))
 
+    @requires('tv_specifier')
     def _render_search_title(self):
         return self['tv_specifier'].title
 
@@ -659,11 +843,14 @@ class TvSubmission(VideoSubmission):
             titles_d['titles']['XWW'] = tvdb_title
         return titles_d
 
+    @requires('source', 'video_codec', 'audio_codec', 'container',
+              'resolution', 'additional')
     def _render_markers(self):
         return [self['source'], self['video_codec'],
                 self['audio_codec'], self['container'],
                 self['resolution']] + self['additional']
 
+    @requires('section_description', 'section_information')
     def _render_description(self):
         sections = [("Description", self['section_description']),
                     ("Information", self['section_information'])]
@@ -673,6 +860,7 @@ class TvSubmission(VideoSubmission):
         return description
 
     @form_field('desc')
+    @requires('description', 'screenshots', 'mediainfo')
     def _render_form_description(self):
         ss = "".join(map(bb.img, self['screenshots']))
         return (self['description'] + "\n" +
@@ -689,6 +877,7 @@ class EpisodeSubmission(TvSubmission):
         return [episodes]
 
     @form_field('title')
+    @requires('title', 'markers')
     def _render_form_title(self):
         return "{t} S{s:02d}{es} [{m}]".format(
             t=self['title'], s=self.season,
@@ -696,9 +885,15 @@ class EpisodeSubmission(TvSubmission):
                        for e in self.episodes),
             m=" / ".join(self['markers']))
 
+    @persistent
+    @requires('tv_specifier', 'tvdb_id')
+    @interactive()
+    @cost(http=3)
     def _render_summary(self):
         t = tvdb.TVDB()
-        results = t.search(self['tv_specifier'], self['tvdb_id'])
+        tv_specifier, tvdb_id = self['tv_specifier'], self['tvdb_id']
+        with prompt_lock:  # tvdb_api may ask to select a show
+            results = t.search(tv_specifier, tvdb_id)
         title_i18n = self.tvdb_title_i18n(results[0])
         summaries = []
         show_summary = results[0].show_summary()
@@ -718,12 +913,15 @@ class EpisodeSubmission(TvSubmission):
         summary['writers'] = [{'name': name} for name in writers]
         return summary
 
+    @requires('summary')
     def _render_section_description(self):
         summary = self['summary']
         return (summary['seriessummary'] +
                 "".join(bb.spoiler(es, "Episode description")
                         for es in summary['episodesummary']))
 
+    @persistent
+    @requires('summary')
     def _render_section_information(self):
         s = self['summary']
         links = [[('TVDB', u)] for u in s['url']]
@@ -765,24 +963,106 @@ class EpisodeSubmission(TvSubmission):
 
 
 class SeasonSubmission(TvSubmission):
+    default_fields = TvSubmission.default_fields + ('season_report',)
+
+    @requires('files')
+    def _render_episode_files(self):
+        return [f.path for f in files.of_type(self['files'], 'video',
+                                              10 * 2**20)]
+
+    @persistent
+    @requires('episode_files')
+    def _render_season_tracks(self):
+        # all episodes are analysed in parallel, the results are cached so
+        # the representative episode is not parsed again. Tracks are None
+        # for episodes that could not be parsed.
+        paths = self['episode_files']
+        season_tracks = {}
+        for p, result in zip(paths, mediainfo.parse_many(paths)):
+            if isinstance(result, Exception):
+                log.warning('Could not parse {}: {}', p, result)
+                season_tracks[p] = None
+            else:
+                season_tracks[p] = result[1]
+        return season_tracks
+
+    @requires('season_tracks')
+    def _render_season_consistency(self):
+        season_tracks = self['season_tracks']
+        paths = sorted(p for p in season_tracks
+                       if season_tracks[p] is not None)
+        common, outliers = mediainfo.consistency(
+            [mediainfo.profile(season_tracks[p]) for p in paths])
+        outliers = {paths[i]: diff for i, diff in outliers.items()}
+        # unreadable episodes are outliers without a profile
+        outliers.update((p, None) for p, tracks in season_tracks.items()
+                        if tracks is None)
+        return common, outliers
+
+    @requires('path', 'episode_files', 'season_consistency')
+    def _render_season_report(self):
+        common, outliers = self['season_consistency']
+        n = len(self['episode_files'])
+        if not n:
+            return "No episode files found"
+        if not outliers:
+            return "All {} episodes are consistent".format(n)
+
+        lines = ["{} of {} episodes are inconsistent:".format(
+            len(outliers), n)]
+        for path, diff in sorted(outliers.items()):
+            if diff is None:
+                lines.append("{}: could not be parsed".format(
+                    os.path.relpath(path, self['path'])))
+                continue
+            for kind, value in sorted(diff.items()):
+                lines.append("{}: {} {} (most episodes: {})".format(
+                    os.path.relpath(path, self['path']), kind, value,
+                    common[kind]))
+        log.warning("\n".join(lines))
+        return "\n".join(lines)
+
+    @requires('episode_files', 'season_consistency')
+    def _render_mediainfo_path(self):
+        paths = self['episode_files']
+        if not paths:
+            return super(SeasonSubmission, self)._render_mediainfo_path()
+
+        # the first episode that is consistent with the rest of the season,
+        # or else the first one that could be parsed
+        _, outliers = self['season_consistency']
+        consistent = [p for p in paths if p not in outliers]
+        readable = [p for p in paths if outliers.get(p) is not None]
+        return (consistent or readable or paths)[0]
+
     @form_field('title')
+    @requires('title', 'tv_specifier', 'markers')
     def _render_form_title(self):
         return "{t} - Season {s} [{m}]".format(
             t=self['title'],
             s=self['tv_specifier'].season,
             m=" / ".join(self['markers']))
 
+    @persistent
+    @requires('tv_specifier', 'tvdb_id')
+    @interactive()
+    @cost(http=3)
     def _render_summary(self):
         t = tvdb.TVDB()
-        result = t.search(self['tv_specifier'], self['tvdb_id'])
+        tv_specifier, tvdb_id = self['tv_specifier'], self['tvdb_id']
+        with prompt_lock:  # tvdb_api may ask to select a show
+            result = t.search(tv_specifier, tvdb_id)
         summary = result.summary()
         summary.update(self.tvdb_title_i18n(result))
         return summary
 
+    @requires('summary')
     def _render_section_description(self):
         summary = self['summary']
         return summary['seriessummary']
 
+    @persistent
+    @requires('summary')
     def _render_section_information(self):
         s = self['summary']
         links = [('TVDB', s['url'])]
@@ -837,10 +1117,13 @@ class MovieSubmission(VideoSubmission):
         'screenshots': (lambda i, v: 'screenshot' + str(i + 1), 'text'),
         }
 
+    @persistent
+    @requires('path')
     def _render_guess(self):
         return dict(guessit.guessit(self['path'],
                                     options=('--type', 'movie')))
 
+    @requires('title_arg', 'guess')
     def _render_search_title(self):
         if self['title_arg']:
             return self['title_arg']
@@ -848,10 +1131,13 @@ class MovieSubmission(VideoSubmission):
         return self['guess']['title']
 
     @form_field('title')
+    @requires('title')
     def _render_form_title(self):
         return self['title']
 
     @form_field('year')
+    @requires('guess')
+    @interactive(when=lambda self: 'year' not in self['guess'])
     def _render_year(self):
         if 'summary' in self.fields:
             return self['summary']['year']
@@ -860,20 +1146,29 @@ class MovieSubmission(VideoSubmission):
             return self['guess']['year']
 
         else:
-            while True:
-                year = input('Please enter year: ')
-                try:
-                    year = int(year)
-                except ValueError:
-                    pass
-                else:
-                    return year
-
+            with prompt_lock:
+                while True:
+                    year = input('Please enter year: ')
+                    try:
+                        year = int(year)
+                    except ValueError:
+                        pass
+                    else:
+                        return year
+
+    @persistent
+    @requires('search_title')
+    @interactive()
+    @cost(http=7)
     def _render_summary(self):
         i = imdb.IMDB()
-        movie = i.search(self['search_title'])
+        search_title = self['search_title']
+        with prompt_lock:  # may ask to select a search result
+            movie = i.search(search_title)
         return movie.summary()
 
+    @persistent
+    @requires('options', 'summary')
     def _render_section_information(self):
         def imdb_link(r):
             return bb.link(r['name'], "https://www.imdb.com"+r['id'])
@@ -915,10 +1210,12 @@ class MovieSubmission(VideoSubmission):
             cast=" | ".join(imdb_link(a) for a in summary['cast'][:n])
         )
 
+    @requires('summary')
     def _render_section_description(self):
         s = self['summary']
         return s['description']
 
+    @requires('section_description', 'section_information')
     def _render_description(self):
         # todo: templating, rottentomatoes, ...
 
@@ -931,6 +1228,7 @@ class MovieSubmission(VideoSubmission):
         return description
 
     @form_field('desc')
+    @requires('description')
     def _render_form_description(self):
         return self['description']
 
@@ -947,6 +1245,7 @@ class AudioSubmission(BbSubmission):
         return MusicSubmission
 
     @form_field('format')
+    @requires('tags')
     def _render_format(self):
         # MP3, FLAC, Ogg, AAC, DTS 5.1 Audio, 24bit FLAC
         # choices = ('MP3', 'FLAC', 'Ogg', 'AAC', '24bit FLAC')
@@ -968,6 +1267,7 @@ class AudioSubmission(BbSubmission):
         return format
 
     @form_field('bitrate')
+    @requires('format', 'tags')
     def _render_bitrate(self):
         # 192, V2 (VBR), 256, V0 (VBR), 320, Lossless, Other)
         format = self['format']
@@ -998,17 +1298,15 @@ class AudioSubmission(BbSubmission):
         log.notice('Unrecognized format/bitrate, assuming "Other"')
         return 'Other'
 
+    @requires('path', 'files')
     def _render_mediainfo_path(self):
         assert os.path.isdir(self['path'])
 
-        # get first file over 1 MiB
-        for dp, _, fns in os.walk(self['path']):
-            for fn in fns:
-                g = guess_type(fn)[0]
-                if g and g.startswith('audio'):
-                    return os.path.join(dp, fn)  # return full path
+        for f in files.of_type(self['files'], 'audio'):
+            return f.path
         raise Exception('No media file found')
 
+    @requires('release')
     def _render_tracklist(self):
         release, _ = self['release']
         full_tracklist = []
@@ -1031,6 +1329,7 @@ class AudioSubmission(BbSubmission):
 
         return full_tracklist
 
+    @requires('mediainfo_path')
     def _render_tags(self):
         tags = mutagen.File(self['mediainfo_path'], easy=True)
         # if type(tags) == mutagen.mp3.MP3:
@@ -1053,6 +1352,10 @@ class AudioSubmission(BbSubmission):
                                             None),
                 }
 
+    @persistent
+    @requires('tags', 'title_arg')
+    @interactive(when=lambda self: not self['tags']['rid'])
+    @cost(http=2)
     def _render_release(self):
         tags = self['tags']
         if tags['rid']:
@@ -1073,7 +1376,8 @@ class AudioSubmission(BbSubmission):
             else:
                 query_artist = tags['artist']
                 query = tags['title']
-            release, rg = mb.find_release(query, artist=query_artist)
+            with prompt_lock:  # may ask to select a search result
+                release, rg = mb.find_release(query, artist=query_artist)
 
         # identify self:
         #  - num tracks todo
@@ -1087,6 +1391,8 @@ class AudioSubmission(BbSubmission):
 
         return release, rg
 
+    @persistent
+    @requires('release')
     def _render_summary(self):
         release, rg = self['release']
 
@@ -1103,6 +1409,9 @@ class AudioSubmission(BbSubmission):
 
     @finalize
     @form_field('image')
+    @requires('release')
+    @interactive()
+    @cost(http=2)
     def _render_cover(self):
         release, rg = self['release']
         cover = None
@@ -1111,17 +1420,21 @@ class AudioSubmission(BbSubmission):
         cover = cover or mb.get_release_group_cover(rg['id'])
 
         if cover is None:
-            cover = input('No cover art found, please manually type cover '
-                          'location: ')
+            with prompt_lock:
+                cover = input('No cover art found, please manually type '
+                              'cover location: ')
         return cover
 
+    @cost(http=1)
     def _finalize_cover(self):
         return imagehosting.upload(self['cover'])
 
     @form_field('year')
+    @requires('summary')
     def _render_year(self):
         return self['summary']['year']
 
+    @requires('release')
     def _render_links(self):
         release, rg = self['release']
         try:
@@ -1135,6 +1448,7 @@ class AudioSubmission(BbSubmission):
             log.warning('No links found for release.')
             return []
 
+    @requires('release', 'links')
     def _render_section_information(self):
         release, rg = self['release']
         urls = self['links']
@@ -1152,6 +1466,7 @@ class AudioSubmission(BbSubmission):
             firstrel=rg['first-release-date'],
             )
 
+    @requires('tracklist')
     def _render_section_tracklist(self):
         s = ""
         for title, tracks in self['tracklist']:
@@ -1164,6 +1479,7 @@ class AudioSubmission(BbSubmission):
         return s
 
     @form_field('album_desc')
+    @requires('section_information')
     def _render_description(self):
         sections = [("Information", self['section_information'])]
 
@@ -1173,6 +1489,7 @@ class AudioSubmission(BbSubmission):
         return description
 
     @form_field('release_desc')
+    @requires('release', 'tags', 'section_tracklist')
     def _render_release_desc(self):
         release, rg = self['release']
         tags = self['tags']
@@ -1206,21 +1523,23 @@ class AudioSubmission(BbSubmission):
 
     def _get_tags(self, required_tags):
         tags = self['summary']['tags']
-        if not tags:
-            tags = input("No tags found. Please enter tags "
-                         "(comma-separated): ").split(',')
-        tags = set(format_tag(tag) for tag in tags)
-        tags -= {'audiobook'}
-        while True:
-            try:
-                assert tags & required_tags != set()
-            except AssertionError:
-                print("Default tags:\n" + ", ".join(sorted(required_tags)))
-                print("Submission must contain at least one default tag.")
-                tags = rlinput("Enter tags: ", ",".join(tags)).split(',')
-                tags = set(format_tag(tag) for tag in tags)
-            else:
-                return ",".join(tags)
+        with prompt_lock:
+            if not tags:
+                tags = input("No tags found. Please enter tags "
+                             "(comma-separated): ").split(',')
+            tags = set(format_tag(tag) for tag in tags)
+            tags -= {'audiobook'}
+            while True:
+                try:
+                    assert tags & required_tags != set()
+                except AssertionError:
+                    print("Default tags:\n" +
+                          ", ".join(sorted(required_tags)))
+                    print("Submission must contain at least one default tag.")
+                    tags = rlinput("Enter tags: ", ",".join(tags)).split(',')
+                    tags = set(format_tag(tag) for tag in tags)
+                else:
+                    return ",".join(tags)
 
 
 class AudiobookSubmission(AudioSubmission):
@@ -1228,11 +1547,14 @@ class AudiobookSubmission(AudioSubmission):
     _form_type = 'Audiobooks'
 
     @form_field('tags')
+    @requires('summary')
+    @interactive()
     def _render_form_tags(self):
         _defaults = {'fiction', 'non.fiction'}
         return self._get_tags(_defaults)
 
     @form_field('title')
+    @requires('summary')
     def _render_title(self):
         return "{} - {}".format(
             self['summary']['artist'], self['summary']['title'])
@@ -1245,24 +1567,33 @@ class MusicSubmission(AudioSubmission):
     _form_type = 'Music'
 
     @form_field('remaster_true', 'checkbox')
+    @interactive()
     def _render_remaster(self):
         # todo user input function/module to reduce boilerplating
-        return bool(
-            input('Is this a special/remastered edition? [y/N] ').lower()
-            == 'y')
+        with prompt_lock:
+            return bool(
+                input('Is this a special/remastered edition? [y/N] ').lower()
+                == 'y')
 
     @form_field('remaster_year')
+    @requires('remaster')
+    @interactive()
     def _render_remaster_year(self):
         if self['remaster']:
-            return input('Please enter the remaster year: ')
+            with prompt_lock:
+                return input('Please enter the remaster year: ')
 
     @form_field('remaster_title')
+    @requires('remaster')
+    @interactive()
     def _render_remaster_title(self):
         if self['remaster']:
-            return (input('Please enter the remaster title (optional): ')
-                    or None)
+            with prompt_lock:
+                return (input('Please enter the remaster title (optional): ')
+                        or None)
 
     @form_field('media')
+    @requires('summary')
     def _render_media(self):
         # choices = ['CD', 'DVD', 'Vinyl', 'Soundboard', 'DAT', 'Web']
 
@@ -1281,6 +1612,8 @@ class MusicSubmission(AudioSubmission):
         raise NotImplementedError(media)
 
     @form_field('tags')
+    @requires('summary')
+    @interactive()
     def _render_form_tags(self):
         _defaults = {
             'acoustic', 'alternative', 'ambient', 'blues', 'classic.rock',
@@ -1293,9 +1626,11 @@ class MusicSubmission(AudioSubmission):
         return self._get_tags(_defaults)
 
     @form_field('artist')
+    @requires('summary')
     def _render_artist(self):
         return self['summary']['artist']
 
     @form_field('title')
+    @requires('summary')
     def _render_title(self):
         return self['summary']['title']
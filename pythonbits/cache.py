@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from hashlib import sha1
+
+import appdirs
+
+from . import __title__ as appname
+from .logging import log
+
+CACHE_DIR = appdirs.user_cache_dir(appname.lower())
+CACHE_PATH = os.path.join(CACHE_DIR, 'cache.sqlite')
+PICKLE_PROTOCOL = 4
+
+
+def file_identity(path):
+    """Identity of a file that changes whenever its content may have"""
+    st = os.stat(path)
+    return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def fingerprint(value):
+    """Hash of a field value. Absolute paths also hash the identity of the
+    file or directory they point to."""
+    h = sha1(pickle.dumps(value, PICKLE_PROTOCOL))
+    if isinstance(value, str) and os.path.isabs(value):
+        try:
+            h.update(repr(file_identity(value)).encode('utf8'))
+        except (OSError, ValueError):
+            pass  # not a path after all, or it does not exist
+    return h.hexdigest()
+
+
+class Store(object):
+    """Compressed pickle store in a single sqlite database. If max_size
+    (in bytes) is given, the least recently used entries are evicted when
+    the table grows larger."""
+    def __init__(self, table, path=CACHE_PATH, max_size=None):
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), 0o700)
+
+        self.table = table
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS {} (key TEXT PRIMARY KEY, '
+                'value BLOB, size INTEGER, atime REAL)'.format(table))
+
+    def get(self, key, default=None):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT value FROM {} WHERE key=?'.format(self.table),
+                (key,)).fetchone()
+            if row is None:
+                return default
+            # access times only matter for eviction
+            if self.max_size is not None:
+                with self._db:
+                    self._db.execute(
+                        'UPDATE {} SET atime=? WHERE key=?'.format(
+                            self.table), (time.time(), key))
+        return pickle.loads(zlib.decompress(row[0]))
+
+    def set(self, key, value):
+        with self._lock, self._db:
+            self._replace(key, value)
+            if self.max_size is not None:
+                self._evict()
+
+    def _replace(self, key, value):
+        blob = zlib.compress(pickle.dumps(value, PICKLE_PROTOCOL))
+        self._db.execute(
+            'REPLACE INTO {} VALUES (?, ?, ?, ?)'.format(self.table),
+            (key, blob, len(blob), time.time()))
+
+    def _evict(self):
+        total, = self._db.execute(
+            'SELECT TOTAL(size) FROM {}'.format(self.table)).fetchone()
+        if total <= self.max_size:
+            return
+
+        rows = self._db.execute(
+            'SELECT key, size FROM {} ORDER BY atime'.format(self.table))
+        evict = []
+        for key, size in rows:
+            if total <= self.max_size:
+                break
+            evict.append((key,))
+            total -= size
+        self._db.executemany(
+            'DELETE FROM {} WHERE key=?'.format(self.table), evict)
+        log.debug('Evicted {} entries from {} cache', len(evict), self.table)
+
+    def delete(self, key):
+        with self._lock, self._db:
+            self._db.execute(
+                'DELETE FROM {} WHERE key=?'.format(self.table), (key,))
+
+
+class FieldCache(Store):
+    """Stores rendered fields together with a trace of the fields they were
+    rendered from. A stored value is only reused if all fields in its trace
+    still have the same fingerprint."""
+    def __init__(self, path=CACHE_PATH):
+        super(FieldCache, self).__init__('fields', path)
+
+    @staticmethod
+    def key(namespace, field):
+        return sha1(pickle.dumps((namespace, field),
+                                 PICKLE_PROTOCOL)).hexdigest()
+
+    def load(self, namespace, field):
+        """Returns (trace, value) or None"""
+        try:
+            return self.get(self.key(namespace, field))
+        except Exception as e:  # e.g. unpickling a class that was removed
+            log.debug('Discarding cached field {}: {!r}', field, e)
+            return None
+
+    def store(self, namespace, field, trace, value):
+        try:
+            self.set(self.key(namespace, field), (trace, value))
+        except (pickle.PicklingError, TypeError, AttributeError,
+                sqlite3.Error) as e:  # e.g. the database is locked
+            log.debug('Not caching field {}: {!r}', field, e)
+
+
+class FileCache(Store):
+    """Results of analysing files, keyed by their path and file identity"""
+    @staticmethod
+    def key(path, *args):
+        path = os.path.abspath(path)
+        return sha1(pickle.dumps((path, file_identity(path)) + args,
+                                 PICKLE_PROTOCOL)).hexdigest()
+
+    def memoize(self, analyse, path, *args):
+        """Returns analyse(path, *args), from the cache if the file did not
+        change since it was last analysed"""
+        try:
+            # analyses of the same file may share a table
+            key = self.key(path, analyse.__name__, *args)
+            rv = self.get(key)
+        except Exception as e:  # e.g. unpickling a changed result format
+            log.debug('Not using cached {} of {}: {!r}', self.table, path, e)
+            return analyse(path, *args)
+
+        if rv is not None:
+            log.debug('Using cached {} of {}', self.table, path)
+            return rv
+        rv = analyse(path, *args)
+        try:
+            self.set(key, rv)
+        except Exception as e:  # e.g. the database is locked
+            log.debug('Not caching {} of {}: {!r}', self.table, path, e)
+        return rv
+
+
+class MediainfoCache(FileCache):
+    """Parsed media files"""
+    def __init__(self, path=CACHE_PATH, max_size=64 * 2**20):
+        super(MediainfoCache, self).__init__('mediainfo', path, max_size)
+
+
+class ProbeCache(FileCache):
+    """Output of ffprobe"""
+    def __init__(self, path=CACHE_PATH, max_size=16 * 2**20):
+        super(ProbeCache, self).__init__('ffprobe', path, max_size)
+
+
+class ScreenshotCache(FileCache):
+    """Screenshot times chosen for media files"""
+    def __init__(self, path=CACHE_PATH, max_size=2**20):
+        super(ScreenshotCache, self).__init__('screenshots', path, max_size)
+
+
+class Timings(Store):
+    """How long rendering or finalizing fields took in previous runs, as a
+    moving average over roughly the last ten runs. Timings are recorded in
+    memory and only stored by flush()."""
+    def __init__(self, path=CACHE_PATH):
+        super(Timings, self).__init__('timings', path)
+        self._recorded = {}
+
+    def record(self, key, seconds):
+        with self._lock:
+            self._recorded.setdefault(key, []).append(seconds)
+
+    def flush(self):
+        """Stores all recorded timings in a single transaction"""
+        with self._lock:
+            recorded, self._recorded = self._recorded, {}
+            if not recorded:
+                return
+            with self._db:
+                for key, samples in recorded.items():
+                    row = self._db.execute(
+                        'SELECT value FROM {} WHERE key=?'.format(
+                            self.table), (key,)).fetchone()
+                    n, mean = (pickle.loads(zlib.decompress(row[0]))
+                               if row is not None else (0, 0.))
+                    for seconds in samples:
+                        n = min(n + 1, 10)
+                        mean += (seconds - mean) / n
+                    self._replace(key, (n, mean))
+
+    def estimate(self, key):
+        """Seconds, or None if unknown"""
+        return self.get(key, (0, None))[1]
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared(cls):
+    """The instance of store class cls shared by this process, or None if
+    it cannot be opened"""
+    # a worker process must not share the connection of its parent
+    key = cls, os.getpid()
+    with _shared_lock:
+        if key not in _shared:
+            try:
+                _shared[key] = cls()
+            except Exception as e:  # e.g. read-only cache directory
+                log.debug('Not using {}: {!r}', cls.__name__, e)
+                _shared[key] = None
+        return _shared[key]
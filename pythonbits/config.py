@@ -6,7 +6,7 @@ import configparser
 import getpass
 import appdirs
 
-from . import __title__ as appname
+from . import __title__ as appname, prompt_lock
 from .logging import log
 
 CONFIG_NAME = appname.lower() + '.cfg'
@@ -69,30 +69,44 @@ class Config():
             except KeyError:
                 raise UnregisteredOption((section, option))
 
-            # get value from user query
-            if reg_option['getpass']:
-                value = getpass.getpass(reg_option['query'] + ": ")
-            else:
-                value = input(reg_option['query'] + ": ").strip()
+            with prompt_lock:
+                return self._query(section, option, reg_option,
+                                   confidential=isinstance(
+                                       e, ConfidentialOption))
+
+    def _query(self, section, option, reg_option, confidential):
+        if not confidential:
+            # another thread may have been asked while we waited
+            self._config.read(self.config_path)
+            if self._config.has_option(section, option):
+                value = self._config.get(section, option)
+                if value is not None:
+                    return value
 
-            # user does not want to be prompted to save this option
-            if isinstance(e, ConfidentialOption):
-                return value
+        # get value from user query
+        if reg_option['getpass']:
+            value = getpass.getpass(reg_option['query'] + ": ")
+        else:
+            value = input(reg_option['query'] + ": ").strip()
 
-            # user has choice ('ask') to save option value
-            if reg_option['ask']:
-                c = input('Would you like to save this value in {}? '
-                          'nr = no, and remember choice\n'
-                          '[Y/n/nr]'.format(self.config_path)).lower()
+        # user does not want to be prompted to save this option
+        if confidential:
+            return value
 
-                if c == 'n':
-                    return value
-                elif c == 'nr':
-                    self.set(section, option, None)
-                    return value
+        # user has choice ('ask') to save option value
+        if reg_option['ask']:
+            c = input('Would you like to save this value in {}? '
+                      'nr = no, and remember choice\n'
+                      '[Y/n/nr]'.format(self.config_path)).lower()
 
-            self.set(section, option, value)
-            return value
+            if c == 'n':
+                return value
+            elif c == 'nr':
+                self.set(section, option, None)
+                return value
+
+        self.set(section, option, value)
+        return value
 
 
 def backup(config):
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Main feature detection for Blu-ray (BDMV) and DVD (VIDEO_TS) structures.
+
+Only the small playlist (MPLS) and information (IFO) files are read, the
+streams they refer to are only looked up in the file index.
+"""
+import os
+import struct
+from collections import namedtuple
+
+from .logging import log
+
+BD_TICKS = 45000  # per second
+DVD_SECTOR = 2048
+
+# index is the playlist or IFO file, clips are the stream files in order
+Feature = namedtuple('Feature', ('kind', 'index', 'duration', 'clips'))
+
+
+def parse_mpls(data):
+    """Duration in seconds and clip names of a Blu-ray playlist"""
+    if data[:4] != b'MPLS':
+        raise ValueError('Not a Blu-ray playlist')
+    playlist, = struct.unpack_from('>I', data, 8)
+    num_items, = struct.unpack_from('>H', data, playlist + 6)
+
+    pos = playlist + 10
+    duration, clips = 0, []
+    for _ in range(num_items):
+        length, = struct.unpack_from('>H', data, pos)
+        clips.append(data[pos + 2:pos + 7].decode('ascii'))
+        in_time, out_time = struct.unpack_from('>II', data, pos + 14)
+        duration += (out_time - in_time) / BD_TICKS
+        pos += 2 + length
+    return duration, clips
+
+
+def _bcd(b):
+    return (b >> 4) * 10 + (b & 0x0f)
+
+
+def parse_vts_ifo(data):
+    """Durations in seconds of the program chains of a DVD title set"""
+    if data[:12] != b'DVDVIDEO-VTS':
+        raise ValueError('Not a DVD title set')
+    pgci = struct.unpack_from('>I', data, 0xcc)[0] * DVD_SECTOR
+    num_pgcs, = struct.unpack_from('>H', data, pgci)
+
+    durations = []
+    for i in range(num_pgcs):
+        pgc = pgci + struct.unpack_from('>I', data, pgci + 12 + 8 * i)[0]
+        hours, minutes, seconds, frames = data[pgc + 4:pgc + 8]
+        fps = 30 if frames >> 6 == 3 else 25
+        durations.append(_bcd(hours) * 3600 + _bcd(minutes) * 60 +
+                         _bcd(seconds) + _bcd(frames & 0x3f) / fps)
+    return durations
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _bluray_features(files):
+    # discs are often copied from case insensitive file systems, so the
+    # names in a playlist need not match the case of the stream files
+    streams = {f.path.lower(): f.path for f in files}
+    for f in files:
+        root, name = os.path.split(f.path)
+        bdmv, playlist_dir = os.path.split(root)
+        if (playlist_dir.upper() != 'PLAYLIST' or
+                os.path.basename(bdmv).upper() != 'BDMV' or
+                not name.lower().endswith('.mpls')):
+            continue
+        try:
+            duration, names = parse_mpls(_read(f.path))
+        except (OSError, ValueError, struct.error) as e:
+            log.debug('Skipping playlist {}: {!r}', f.path, e)
+            continue
+
+        clips = []
+        for clip in names:
+            path = streams.get(
+                os.path.join(bdmv, 'STREAM', clip + '.m2ts').lower())
+            if path is None:
+                break
+            if path not in clips:  # obfuscated playlists repeat clips
+                clips.append(path)
+        else:
+            yield Feature('BDMV', f.path, duration, clips)
+
+
+def _dvd_features(files):
+    vobs = sorted(f.path for f in files if f.path.upper().endswith('.VOB'))
+    for f in files:
+        name = os.path.basename(f.path).upper()
+        if not (name.startswith('VTS_') and name.endswith('_0.IFO')):
+            continue
+        try:
+            durations = parse_vts_ifo(_read(f.path))
+        except (OSError, ValueError, struct.error) as e:
+            log.debug('Skipping title set {}: {!r}', f.path, e)
+            continue
+
+        # the title set's VOBs except the menu, VTS_nn_0.VOB
+        prefix = f.path[:-len('0.IFO')].upper()
+        clips = [vob for vob in vobs if vob.upper().startswith(prefix) and
+                 not vob.upper().endswith('_0.VOB')]
+        if durations and clips:
+            yield Feature('VIDEO_TS', f.path, max(durations), clips)
+
+
+def main_feature(files):
+    """The longest title of the Blu-ray or DVD structures in a file index
+    (see files.scan), or None if there are none"""
+    features = list(_bluray_features(files)) + list(_dvd_features(files))
+    if not features:
+        return None
+    feature = max(features, key=lambda f: (f.duration, len(f.clips)))
+    log.info('Main feature is {} ({:.0f} min, {} clips)', feature.index,
+             feature.duration / 60, len(feature.clips))
+    return feature
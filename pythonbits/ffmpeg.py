@@ -5,38 +5,267 @@ ffmpeg.py
 Created by Ichabond on 2012-07-01.
 Copyright (c) 2012 Baconseed. All rights reserved.
 """
+import json
 import os
 import subprocess
-import re
+from bisect import bisect_left
+from fractions import Fraction
 
 from tempfile import mkdtemp
 from concurrent.futures.thread import ThreadPoolExecutor
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .cache import ProbeCache, ScreenshotCache, shared
+from .logging import log
+
+# scales anamorphic video to its display aspect ratio
+SCALE = "scale='max(sar,1)*iw':'max(1/sar,1)*ih'"
+# screenshot candidates are scored at this width and rate (per second)
+CANDIDATE_WIDTH = 320
+CANDIDATE_RATE = 2
+# the whole video is analysed at this width and rate to plan screenshots
+ANALYSIS_WIDTH = 64
+ANALYSIS_RATE = 1
+# contact sheets are this wide, with this many thumbnails per row
+CONTACT_SHEET_WIDTH = 1600
+CONTACT_SHEET_COLUMNS = 4
+# screenshots whose difference hashes differ in at most this many of their
+# 64 bits are near-duplicates
+DUPLICATE_DISTANCE = 10
+
 
 class FfmpegException(Exception):
     pass
 
 
+def _ffprobe(path, *args):
+    try:
+        out = subprocess.check_output(
+            ["ffprobe", "-v", "error", "-print_format", "json"] +
+            list(args) + [path], stderr=subprocess.PIPE)
+    except subprocess.CalledProcessError as e:
+        raise FfmpegException("ffprobe could not read {}: {}".format(
+            path, e.stderr.decode('utf8', 'replace').strip()))
+    return json.loads(out.decode('utf8'))
+
+
+def _probe(path):
+    return _ffprobe(path, "-show_format", "-show_streams")
+
+
+def _keyframes(path):
+    packets = _ffprobe(path, "-select_streams", "v:0",
+                       "-show_entries", "packet=pts_time,flags")
+    return sorted(float(p['pts_time']) for p in packets.get('packets', [])
+                  if 'K' in p.get('flags', '') and
+                  p.get('pts_time', 'N/A') != 'N/A')
+
+
+def probe(path, cache=True):
+    """Format and streams of path as reported by ffprobe (its JSON output
+    with the keys 'format' and 'streams'). Cached until the file changes."""
+    probe_cache = shared(ProbeCache) if cache else None
+    if probe_cache is None:
+        return _probe(path)
+    return probe_cache.memoize(_probe, path)
+
+
+def keyframes(path, cache=True):
+    """Sorted timestamps in seconds of the keyframes of the first video
+    stream. This reads (but does not decode) the whole file."""
+    probe_cache = shared(ProbeCache) if cache else None
+    if probe_cache is None:
+        return _keyframes(path)
+    return probe_cache.memoize(_keyframes, path)
+
+
+def duration(info):
+    """Duration in seconds of probed media"""
+    try:
+        return float(info['format']['duration'])
+    except (KeyError, ValueError):
+        # some containers only know the duration of their streams
+        durations = [float(s['duration']) for s in info.get('streams', [])
+                     if s.get('duration', 'N/A') != 'N/A']
+        if not durations:
+            raise FfmpegException("ffprobe did not report a duration")
+        return max(durations)
+
+
+def video_stream(info):
+    """The first video stream of probed media that is not cover art"""
+    for stream in info.get('streams', []):
+        if (stream.get('codec_type') == 'video' and
+                not stream.get('disposition', {}).get('attached_pic')):
+            return stream
+    raise FfmpegException("ffprobe did not find a video stream")
+
+
+def _ratio(s):
+    try:
+        num, den = map(int, s.split(':'))
+        return Fraction(num, den) if num and den else None
+    except (AttributeError, ValueError):
+        return None
+
+
+def aspect_ratios(stream):
+    """Sample and display aspect ratio of a probed video stream"""
+    sar = _ratio(stream.get('sample_aspect_ratio')) or Fraction(1)
+    dar = (_ratio(stream.get('display_aspect_ratio')) or
+           Fraction(stream['width'], stream['height']) * sar)
+    return sar, dar
+
+
+def nearest_keyframe(seek, keyframes):
+    """The keyframe closest to seek, so that seeking does not have to
+    decode up to seek from an earlier keyframe"""
+    if not keyframes:
+        return seek
+    i = bisect_left(keyframes, seek)
+    return min(keyframes[max(i - 1, 0):i + 1], key=lambda k: abs(k - seek))
+
+
+def frame_score(frame):
+    """How good a grayscale frame (an array of luma values) would look as a
+    screenshot: its sharpness as the variance of its Laplacian, weighted by
+    the entropy of its histogram. Black and white frames score 0."""
+    if not 16 <= frame.mean() <= 240:
+        return 0.
+    p = numpy.bincount(frame.ravel(), minlength=256) / frame.size
+    p = p[p > 0]
+    entropy = -(p * numpy.log2(p)).sum()
+
+    f = frame.astype(numpy.float32)
+    laplacian = (f[:-2, 1:-1] + f[2:, 1:-1] + f[1:-1, :-2] + f[1:-1, 2:] -
+                 4 * f[1:-1, 1:-1])
+    return float(laplacian.var() * entropy)
+
+
+def best_candidate(path, width, height):
+    """Index of the best frame in a file of raw 8-bit grayscale frames"""
+    data = numpy.fromfile(path, numpy.uint8)
+    frames = data[:data.size - data.size % (width * height)].reshape(
+        -1, height, width)
+    if not len(frames):
+        return 0
+    return int(numpy.argmax([frame_score(f) for f in frames]))
+
+
+def dhash(frame):
+    """Difference hash of a grayscale frame of 8 rows and 9 columns: for
+    each pixel, whether it is brighter than its left neighbour"""
+    bits = (frame[:, 1:] > frame[:, :-1]).ravel()
+    return int.from_bytes(numpy.packbits(bits).tobytes(), 'big')
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def tile(frames, num, columns, height, width, padding=4):
+    """Tiles up to num frames (arrays of height x width x 3) into rows of
+    columns frames on a black background"""
+    rows = -(-num // columns)
+    sheet = numpy.zeros((rows * (height + padding) + padding,
+                         columns * (width + padding) + padding, 3),
+                        numpy.uint8)
+    for i, frame in zip(range(num), frames):
+        row, column = divmod(i, columns)
+        y = padding + row * (height + padding)
+        x = padding + column * (width + padding)
+        sheet[y:y + height, x:x + width] = frame
+    return sheet
+
+
+def choose_times(times, means, stds, changes, num):
+    """Chooses num timestamps spread across the runtime from the luma
+    statistics of sampled frames. Black, white and flat frames, the first
+    5% and the end credits are avoided, and within each part of the
+    runtime the frame with the most contrast away from a scene change is
+    chosen. Returns None if fewer than num frames were sampled."""
+    n = len(times)
+    if n < num:
+        return None
+    # the credits are the dark end of the video, smoothed over a few
+    # frames so that a bright title card does not end them
+    k = min(n, 10)
+    smooth = numpy.convolve(means, numpy.ones(k) / k, 'same')
+    bright = numpy.nonzero(smooth[:int(n * 0.95)] >= 40)[0]
+    start = int(n * 0.05)
+    end = bright[-1] + 1 if len(bright) else n
+    if end - start < num:
+        start, end = 0, n
+
+    eligible = (means >= 24) & (means <= 235) & (stds >= 16)
+    # a scene change into or out of the frame
+    change = numpy.maximum(changes, numpy.append(changes[1:], 0))
+    score = numpy.where(eligible, stds / (1 + change), 0)
+
+    chosen = []
+    for part in numpy.array_split(numpy.arange(start, end), num):
+        best = part[numpy.argmax(score[part])]
+        if not score[best]:
+            best = part[len(part) // 2]
+        chosen.append(float(times[best]))
+    return chosen
+
+
+def optimise_png(path):
+    """Losslessly recompresses a PNG with the best filter for each row and
+    maximum compression. The PNG is only replaced if that made it
+    smaller."""
+    fname_out = os.path.splitext(path)[0] + '-optimised.png'
+    proc = subprocess.Popen(
+        [r"ffmpeg", "-v", "error", "-y",
+         "-i", path,
+         "-pred", "mixed",
+         "-compression_level", "9",
+         "-f", "image2", fname_out],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    out = proc.communicate()[0].decode('utf8', 'replace').strip()
+    if proc.returncode or not os.path.isfile(fname_out):
+        log.notice('Could not optimise {}: {}', path, out)
+    elif os.path.getsize(fname_out) < os.path.getsize(path):
+        os.replace(fname_out, path)
+    if os.path.isfile(fname_out):
+        os.remove(fname_out)
+
+
+def optimise_pngs(paths, max_workers=None):
+    """Optimises the PNGs among paths in place, with one ffmpeg process per
+    image running in parallel. Only meant for images this module made."""
+    pngs = [path for path in paths
+            if path.lower().endswith('.png') and os.path.isfile(path)]
+    before = sum(os.path.getsize(path) for path in pngs)
+    with ThreadPoolExecutor(max_workers or os.cpu_count()) as executor:
+        list(executor.map(optimise_png, pngs))
+    after = sum(os.path.getsize(path) for path in pngs)
+
+    if before:
+        log.notice('Optimised screenshots from {:.1f} to {:.1f} MiB '
+                   '(saved {:.0%})', before / 2**20, after / 2**20,
+                   1 - after / before)
+
+
 class FFMpeg(object):
-    def __init__(self, filepath):
+    def __init__(self, filepath, info=None):
         self.file = filepath
-        self.ffmpeg = None
+        self._info = info
         self.tempdir = mkdtemp(prefix="pythonbits-") + os.sep
 
+    @property
+    def info(self):
+        if self._info is None:
+            self._info = probe(self.file)
+        return self._info
+
     def duration(self):
-        self.ffmpeg = subprocess.Popen([r"ffmpeg", "-i", self.file],
-                                       stdout=subprocess.PIPE,
-                                       stderr=subprocess.STDOUT)
-        ffmpeg_out = self.ffmpeg.stdout.read().decode('utf8')
-        ffmpeg_duration = re.findall(
-            r'Duration:\D(\d{2}):(\d{2}):(\d{2})', ffmpeg_out)
-        if not ffmpeg_duration:
-            raise FfmpegException("ffmpeg output did not contain 'Duration'")
-        dur = ffmpeg_duration[0]
-        dur_hh = int(dur[0])
-        dur_mm = int(dur[1])
-        dur_ss = int(dur[2])
-        return dur_hh * 3600 + dur_mm * 60 + dur_ss
+        return duration(self.info)
 
     def make_screenshot(self, seek, fname_out):
         subprocess.Popen(
@@ -46,18 +275,289 @@ class FFMpeg(object):
              "-vframes", "1",
              "-y",
              "-f", "image2",
-             "-vf", "scale='max(sar,1)*iw':'max(1/sar,1)*ih'", fname_out],
+             "-vf", SCALE, fname_out],
             stdout=subprocess.PIPE, stderr=subprocess.STDOUT).communicate()
         return fname_out
 
-    def take_screenshots(self, num_screenshots):
+    def make_screenshots(self, shots):
+        """Takes screenshots at (seek, fname_out) pairs in a single ffmpeg
+        process. Every seek opens the file as another input, so the
+        container is seeked through in order instead of by concurrent
+        processes, and each input is mapped to its own output."""
+        stream = video_stream(self.info)['index']
+        args = [r"ffmpeg", "-v", "error", "-y"]
+        for seek, _ in shots:
+            args += ["-ss", str(seek), "-i", self.file]
+        for i, (_, fname_out) in enumerate(shots):
+            args += ["-map", "{}:{}".format(i, stream),
+                     "-vframes", "1",
+                     "-f", "image2",
+                     "-vf", SCALE, fname_out]
+
+        self._run(args, [fname_out for _, fname_out in shots])
+        return [fname_out for _, fname_out in shots]
+
+    def best_seeks(self, seeks, candidates):
+        """Seeks to the best of the candidates frames following each seek.
+        One ffmpeg process extracts small grayscale bursts of frames, which
+        are then scored in parallel threads."""
+        stream = video_stream(self.info)
+        width = CANDIDATE_WIDTH
+        height = max(2, int(round(width / aspect_ratios(stream)[1] / 2)) * 2)
+        bursts = [os.path.join(self.tempdir, "candidates%s.gray" % i)
+                  for i in range(len(seeks))]
+
+        args = [r"ffmpeg", "-v", "error", "-y"]
+        for seek in seeks:
+            args += ["-ss", str(seek), "-i", self.file]
+        for i, burst in enumerate(bursts):
+            args += ["-map", "{}:{}".format(i, stream['index']),
+                     "-vframes", str(candidates),
+                     "-vf", "fps={},scale={}:{}".format(
+                         CANDIDATE_RATE, width, height),
+                     "-f", "rawvideo", "-pix_fmt", "gray", burst]
+        try:
+            self._run(args, bursts)
+            # threads, as NumPy releases the GIL and forking from a
+            # rendering thread could inherit locks held by other threads
+            max_workers = min(len(bursts), os.cpu_count() or 1)
+            with ThreadPoolExecutor(max_workers) as executor:
+                best = list(executor.map(best_candidate, bursts,
+                                         [width] * len(bursts),
+                                         [height] * len(bursts)))
+        finally:
+            for burst in bursts:
+                if os.path.exists(burst):
+                    os.remove(burst)
+        return [seek + i / CANDIDATE_RATE for seek, i in zip(seeks, best)]
+
+    def frame_hashes(self, seeks):
+        """Difference hashes of the frames at seeks, from one ffmpeg
+        process"""
+        stream = video_stream(self.info)
+        frames = [os.path.join(self.tempdir, "hash%s.gray" % i)
+                  for i in range(len(seeks))]
+        args = [r"ffmpeg", "-v", "error", "-y"]
+        for seek in seeks:
+            args += ["-ss", str(seek), "-i", self.file]
+        for i, frame in enumerate(frames):
+            args += ["-map", "{}:{}".format(i, stream['index']),
+                     "-vframes", "1",
+                     "-vf", "scale=9:8",
+                     "-f", "rawvideo", "-pix_fmt", "gray", frame]
+        try:
+            self._run(args, frames)
+            return [dhash(numpy.fromfile(frame, numpy.uint8).reshape(8, 9))
+                    for frame in frames]
+        finally:
+            for frame in frames:
+                if os.path.exists(frame):
+                    os.remove(frame)
+
+    def distinct_seeks(self, seeks):
+        """Replaces seeks to near-duplicate frames, e.g. of static
+        content, with nearby seeks to distinct frames where possible. The
+        result is cached for the file and seeks."""
+        dedupe_cache = shared(ScreenshotCache)
+        if dedupe_cache is None:
+            return self._distinct_seeks(seeks)
+        return dedupe_cache.memoize(
+            lambda path, seeks: self._distinct_seeks(list(seeks)),
+            self.file, tuple(seeks))
+
+    def _distinct_seeks(self, seeks):
+        hashes = self.frame_hashes(seeks)
+        duplicates = [i for i in range(len(seeks)) if any(
+            hamming(hashes[i], h) <= DUPLICATE_DISTANCE for h in hashes[:i])]
+        if not duplicates:
+            return seeks
+
+        # alternatives up to two steps away, in between neighbouring seeks
         duration = self.duration()
-        stops = range(20, 81, 60 // (num_screenshots - 1))
+        step = duration / (4 * len(seeks))
+        alternatives = {i: [s for s in (seeks[i] + k * step for k in (
+            1, -1, 2, -2)) if 0 <= s < duration] for i in duplicates}
+        alternative_seeks = [s for i in duplicates for s in alternatives[i]]
+        alternative_hashes = dict(zip(alternative_seeks,
+                                      self.frame_hashes(alternative_seeks)))
+
+        chosen, kept = [], []
+        for i, seek in enumerate(seeks):
+            for alt, h in [(seek, hashes[i])] + [
+                    (alt, alternative_hashes[alt])
+                    for alt in alternatives.get(i, [])]:
+                if all(hamming(h, k) > DUPLICATE_DISTANCE for k in kept):
+                    seek = alt
+                    break
+            else:
+                h = hashes[i]
+            chosen.append(seek)
+            kept.append(h)
+        log.notice('Replaced {} of {} near-duplicate screenshots',
+                   sum(a != b for a, b in zip(seeks, chosen)), len(duplicates))
+        return chosen
+
+    def analyse(self, rate=ANALYSIS_RATE, width=ANALYSIS_WIDTH):
+        """Luma statistics of the video from one streaming decode of its
+        keyframes at low resolution and frame rate. Returns arrays of the
+        timestamps, mean and standard deviation of the frames and of a
+        scene change score. Only the statistics and the previous frame are
+        held in memory."""
+        stream = video_stream(self.info)
+        height = max(2, int(round(width / aspect_ratios(stream)[1] / 2)) * 2)
+        size = width * height
+        # only keyframes are decoded, which is an order of magnitude faster
+        # and still samples every shot for the fps filter to repeat
+        proc = subprocess.Popen(
+            [r"ffmpeg", "-v", "error",
+             "-skip_frame", "nokey",
+             "-i", self.file,
+             "-map", "0:{}".format(stream['index']),
+             "-vf", "fps={},scale={}:{}".format(rate, width, height),
+             "-f", "rawvideo", "-pix_fmt", "gray", "-"],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+        means, stds, changes = [], [], []
+        previous = None
+        try:
+            while True:
+                buf = proc.stdout.read(size)
+                if len(buf) < size:
+                    break
+                frame = numpy.frombuffer(buf, numpy.uint8).astype(
+                    numpy.float32)
+                means.append(frame.mean())
+                stds.append(frame.std())
+                changes.append(0. if previous is None else
+                               numpy.abs(frame - previous).mean())
+                previous = frame
+        finally:
+            proc.stdout.close()
+            proc.wait()
+
+        if proc.returncode or not means:
+            raise FfmpegException("ffmpeg could not analyse {}".format(
+                self.file))
+        return (numpy.arange(len(means)) / rate, numpy.array(means),
+                numpy.array(stds), numpy.array(changes))
+
+    def _frames(self, proc, height, width):
+        size = height * width * 3
+        try:
+            while True:
+                buf = proc.stdout.read(size)
+                if len(buf) < size:
+                    break
+                yield numpy.frombuffer(buf, numpy.uint8).reshape(
+                    height, width, 3)
+        finally:
+            proc.stdout.close()
+            proc.wait()
+
+    def make_contact_sheet(self, num, columns=CONTACT_SHEET_COLUMNS,
+                           sheet_width=CONTACT_SHEET_WIDTH):
+        """A single image of num thumbnails sampled periodically from the
+        video between 5 and 95% of its runtime, from one decode of its
+        keyframes. Only the sheet itself is held in memory."""
+        stream = video_stream(self.info)
+        duration = self.duration()
+        start, span = duration * 0.05, duration * 0.9
+        width = (sheet_width - 4 * (columns + 1)) // columns // 2 * 2
+        height = max(2, int(round(width / aspect_ratios(stream)[1] / 2)) * 2)
+
+        proc = subprocess.Popen(
+            [r"ffmpeg", "-v", "error",
+             "-skip_frame", "nokey",
+             "-ss", str(start),
+             "-i", self.file,
+             "-t", str(span),
+             "-map", "0:{}".format(stream['index']),
+             "-vf", "fps={}/{},scale={}:{}".format(num, span, width, height),
+             "-vframes", str(num),
+             "-f", "rawvideo", "-pix_fmt", "rgb24", "-"],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        sheet = tile(self._frames(proc, height, width), num, columns,
+                     height, width)
+        if proc.returncode:
+            raise FfmpegException("ffmpeg could not decode {}".format(
+                self.file))
+
+        fname_out = os.path.join(self.tempdir, "contact_sheet.png")
+        proc = subprocess.Popen(
+            [r"ffmpeg", "-v", "error", "-y",
+             "-f", "rawvideo", "-pix_fmt", "rgb24",
+             "-s", "{}x{}".format(sheet.shape[1], sheet.shape[0]),
+             "-i", "-",
+             "-pred", "mixed",
+             "-f", "image2", fname_out],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT)
+        out = proc.communicate(sheet.tobytes())[0]
+        if proc.returncode:
+            raise FfmpegException("ffmpeg could not write contact sheet: " +
+                                  out.decode('utf8', 'replace').strip())
+        return fname_out
+
+    def plan_screenshots(self, num_screenshots):
+        """Timestamps of representative frames for screenshots, or None if
+        the video is too short to choose from"""
+        return choose_times(*self.analyse(), num=num_screenshots)
+
+    @staticmethod
+    def _run(args, outputs):
+        proc = subprocess.Popen(args, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        out = proc.communicate()[0].decode('utf8', 'replace').strip()
+        missing = [f for f in outputs if not os.path.isfile(f)]
+        if proc.returncode or missing:
+            raise FfmpegException("ffmpeg failed: " +
+                                  (out or "missing " + ", ".join(missing)))
+
+    def take_screenshots(self, num_screenshots, keyframes=None,
+                         single_process=True, candidates=1, seeks=None,
+                         dedupe=True):
+        """Takes screenshots at fixed stops between 20 and 80% of the
+        runtime, or at seeks (in seconds) if given. If keyframes are given,
+        seeks to the keyframe nearest to each stop instead.
+
+        If NumPy is installed, near-duplicate screenshots are replaced
+        unless dedupe is False, and if candidates is larger than 1, the
+        best of that many frames after each stop is taken. Unless
+        single_process is False, all screenshots are taken by one ffmpeg
+        process, falling back to one process per screenshot if that
+        fails."""
+        duration = self.duration()
+        if seeks is None:
+            stops = range(20, 81, 60 // (num_screenshots - 1))
+            seeks = [duration * stop / 100 for stop in stops]
+        else:
+            stops = range(len(seeks))
+        seeks = [nearest_keyframe(seek, keyframes) for seek in seeks]
+
+        if numpy is None:
+            log.debug('Not analysing screenshot candidates without NumPy')
+        if numpy is not None and dedupe:
+            try:
+                seeks = self.distinct_seeks(seeks)
+            except FfmpegException as e:
+                log.notice('Could not compare screenshots: {}', e)
+        if numpy is not None and candidates > 1:
+            try:
+                seeks = self.best_seeks(seeks, candidates)
+            except FfmpegException as e:
+                log.notice('Could not score screenshot candidates: {}', e)
+
+        shots = [(seek, os.path.join(self.tempdir, "screen%s.png" % stop))
+                 for seek, stop in zip(seeks, stops)]
+
+        if single_process:
+            try:
+                return self.make_screenshots(shots)
+            except FfmpegException as e:
+                log.notice('{}, retrying with one process per screenshot',
+                           e)
 
         with ThreadPoolExecutor() as executor:
-            imgs = executor.map(
-                lambda x: self.make_screenshot(x[0], x[1]),
-                [(duration * stop / 100,
-                 os.path.join(self.tempdir, "screen%s.png" % stop))
-                 for stop in stops])
+            imgs = executor.map(lambda x: self.make_screenshot(x[0], x[1]),
+                                shots)
         return list(imgs)
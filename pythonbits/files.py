@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import mimetypes
+import os
+from collections import namedtuple
+from mimetypes import guess_type
+
+# streams of Blu-ray and DVD structures, unknown to mimetypes
+mimetypes.add_type('video/mp2t', '.m2ts')
+mimetypes.add_type('video/mpeg', '.vob')
+
+# an entry of the index of a release, mime is the guessed type or None
+File = namedtuple('File', ('path', 'size', 'mime'))
+
+
+def scan(path):
+    """Index of all files at path, which is a file or a directory tree.
+
+    The tree is walked once with os.scandir and each file is stat'ed once,
+    so consumers filtering by size or type do not have to touch the file
+    system again. Symlinked directories are not followed. Entries are
+    sorted by path."""
+    if not os.path.isdir(path):
+        return [File(path, os.path.getsize(path), guess_type(path)[0])]
+
+    files = []
+    dirs = [path]
+    while dirs:
+        for entry in os.scandir(dirs.pop()):
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(entry.path)
+            elif entry.is_file():
+                files.append(File(entry.path, entry.stat().st_size,
+                                  guess_type(entry.name)[0]))
+    return sorted(files)
+
+
+def total_size(files):
+    return sum(f.size for f in files)
+
+
+def of_type(files, media_type, min_size=0):
+    """Files whose guessed mime type is media_type (e.g. 'video') and that
+    are larger than min_size bytes"""
+    return [f for f in files
+            if f.mime and f.mime.split('/')[0] == media_type and
+            f.size > min_size]
@@ -1,4 +1,7 @@
 # -*- coding: utf-8 -*-
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from .config import config
 
 from .imgur import ImgurUploader
@@ -21,11 +24,53 @@ def get_provider():
         ))
 
 
+_uploader = None
+_uploader_lock = threading.Lock()
+
+
+def get_uploader():
+    """Uploader shared by all threads, so that concurrent uploads do not
+    each log in"""
+    global _uploader
+    with _uploader_lock:
+        if _uploader is None:
+            _uploader = get_provider()()
+        return _uploader
+
+
 def upload(*images, uploader=None):
     if not uploader:
-        provider = get_provider()
-        uploader = provider()
+        uploader = get_uploader()
     upload_gen = uploader.upload(*images)
     if len(images) == 1:
         return next(upload_gen)
     return list(upload_gen)
+
+
+def upload_stream(images, max_in_flight=4, uploader=None):
+    """Uploads images one by one as they are produced by the iterable
+    images, with at most max_in_flight uploads running at a time. Returns
+    the URLs in the order of images."""
+    if not uploader:
+        uploader = get_uploader()
+    in_flight = threading.BoundedSemaphore(max_in_flight)
+
+    def upload_one(image):
+        try:
+            return next(uploader.upload(image))
+        finally:
+            in_flight.release()
+
+    futures = []
+    images = iter(images)
+    with ThreadPoolExecutor(max_in_flight) as executor:
+        while True:
+            # do not produce further images while all uploads are busy
+            in_flight.acquire()
+            try:
+                image = next(images)
+            except StopIteration:
+                in_flight.release()
+                break
+            futures.append(executor.submit(upload_one, image))
+    return [future.result() for future in futures]
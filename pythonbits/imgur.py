@@ -4,6 +4,7 @@ import json
 from urllib.parse import urlparse
 
 from .api_utils import d
+from . import prompt_lock
 from .config import config
 from .logging import log
 
@@ -21,16 +22,17 @@ class ImgurAuth(object):
         self.access_token = None
 
     def prepare(self):
-        if self.access_token:
-            # Already prepared
-            return
+        with prompt_lock:
+            if self.access_token:
+                # Already prepared
+                return
 
-        if self.refresh_token:
-            self.refresh_access_token()
+            if self.refresh_token:
+                self.refresh_access_token()
 
-        while not self.access_token:
-            log.notice("You are not currently logged in.")
-            self.request_login()
+            while not self.access_token:
+                log.notice("You are not currently logged in.")
+                self.request_login()
 
     def request_login(self):
         user_url = USER_URL_TEMPLATE % d(client_id)
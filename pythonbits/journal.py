@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import os
+import pickle
+import struct
+import threading
+import zlib
+from hashlib import sha1
+
+from .cache import CACHE_DIR, PICKLE_PROTOCOL, fingerprint
+from .logging import log
+
+JOURNAL_DIR = os.path.join(CACHE_DIR, 'journals')
+
+
+class Journal(object):
+    """Append-only record of the progress of a submission.
+
+    Every record is framed with its length and checksum and written with a
+    single write() on a file opened for appending, so checkpointing never
+    rewrites earlier state. A record torn by a crash is skipped when the
+    journal is read, and truncated before the next record is appended."""
+    frame = struct.Struct('>II')  # length, crc32
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_media(cls, media_path):
+        if not os.path.exists(JOURNAL_DIR):
+            os.makedirs(JOURNAL_DIR, 0o700)
+        name = sha1(os.path.abspath(media_path).encode('utf8')).hexdigest()
+        return cls(os.path.join(JOURNAL_DIR, name + '.journal'))
+
+    def append(self, *record):
+        """Returns False if the record could not be serialized or
+        written"""
+        try:
+            data = pickle.dumps(record, PICKLE_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            log.debug('Not journaling {}: {!r}', record[:2], e)
+            return False
+
+        with self._lock:
+            if self._fd is None:
+                self._truncate_torn()
+                self._fd = os.open(self.path,
+                                   os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                                   0o600)
+            buf = self.frame.pack(len(data), zlib.crc32(data)) + data
+            try:
+                while buf:
+                    buf = buf[os.write(self._fd, buf):]
+            except OSError as e:  # e.g. the disk is full
+                # the next append truncates the torn record first
+                os.close(self._fd)
+                self._fd = None
+                log.warning('Could not journal {}: {}', record[:2], e)
+                return False
+        return True
+
+    def records(self):
+        records, pos, size = self._read()
+        if pos < size:
+            log.notice('Ignoring incomplete checkpoint at end of {}',
+                       self.path)
+        return records
+
+    def _truncate_torn(self):
+        # records appended after a torn one could never be read
+        _, pos, size = self._read()
+        if pos < size:
+            log.notice('Dropping incomplete checkpoint at end of {}',
+                       self.path)
+            with open(self.path, 'r+b') as f:
+                f.truncate(pos)
+
+    def _read(self):
+        """Returns the intact records, their total size and the size of
+        the journal"""
+        try:
+            with open(self.path, 'rb') as f:
+                buf = f.read()
+        except FileNotFoundError:
+            return [], 0, 0
+
+        records = []
+        pos = 0
+        while pos + self.frame.size <= len(buf):
+            length, crc = self.frame.unpack_from(buf, pos)
+            data = buf[pos + self.frame.size:pos + self.frame.size + length]
+            if len(data) < length or zlib.crc32(data) != crc:
+                break
+            try:
+                records.append(pickle.loads(data))
+            except Exception as e:  # e.g. unpickling a class that was removed
+                log.debug('Discarding journal record: {!r}', e)
+                break
+            pos += self.frame.size + length
+        return records, pos, len(buf)
+
+    def clear(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+def resume(journal):
+    """Recreates the submission recorded in journal, or returns None if
+    there is nothing to resume or the media changed since it was
+    recorded"""
+    sub = None
+    for kind, *args in journal.records():
+        if kind == 'start':
+            Category, fields, media = args
+            if fingerprint(fields.get('path')) != media:
+                log.notice('Not resuming, {} changed since it was recorded',
+                           fields.get('path'))
+                return None
+            sub = Category(**fields)
+        elif sub is None:
+            break  # journal without a start record
+        elif kind == 'category':
+            Category, = args
+            depends_on = sub.depends_on
+            sub = Category(**sub.fields)
+            sub.depends_on = depends_on
+        elif kind == 'render':
+            field, value, reads = args
+            sub.depends_on.remove_dependencies(field)
+            for f in reads:
+                sub.depends_on.add(f, field)
+            sub.fields[field] = value
+        elif kind == 'set':
+            field, value = args
+            sub[field] = value
+        elif kind == 'invalidate':
+            field, = args
+            sub.invalidate_field_cache(field)
+        elif kind == 'finalizing':
+            sub._finalizing.update(*args)
+        elif kind == 'finalized':
+            field, = args
+            sub.finalized.add(field)
+
+    if sub is not None:
+        log.notice('Resuming {} with {} fields ({} finalized)',
+                   type(sub).__name__, len(sub.fields), len(sub.finalized))
+        sub.journal = journal
+    return sub
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+In-process access to libmediainfo.
+
+A file is opened and parsed once, and both the text report (as printed by
+the mediainfo CLI) and the tracks (as parsed by pymediainfo) are produced
+from that single parse.
+"""
+import ctypes
+import ctypes.util
+import os
+import re
+import sys
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import pymediainfo
+
+from .cache import MediainfoCache, shared
+from .logging import log
+
+_lib = None
+_lib_lock = threading.Lock()
+
+
+class MediainfoException(Exception):
+    pass
+
+
+def _library_paths():
+    if os.name == 'nt':
+        names = ['MediaInfo.dll']
+    elif sys.platform == 'darwin':
+        names = ['libmediainfo.0.dylib', 'libmediainfo.dylib']
+    else:
+        names = ['libmediainfo.so.0']
+
+    # wheels of pymediainfo ship the library next to the module
+    bundled = os.path.dirname(pymediainfo.__file__)
+    paths = [os.path.join(bundled, name) for name in names]
+    paths += names
+    system = ctypes.util.find_library('mediainfo')
+    if system:
+        paths.append(system)
+    return paths
+
+
+def _load_library():
+    lib_type = ctypes.WinDLL if os.name == 'nt' else ctypes.CDLL
+    errors = []
+    for path in _library_paths():
+        try:
+            lib = lib_type(path)
+        except OSError as e:
+            errors.append(str(e))
+            continue
+
+        lib.MediaInfo_New.argtypes = []
+        lib.MediaInfo_New.restype = ctypes.c_void_p
+        lib.MediaInfo_Option.argtypes = [ctypes.c_void_p, ctypes.c_wchar_p,
+                                         ctypes.c_wchar_p]
+        lib.MediaInfo_Option.restype = ctypes.c_wchar_p
+        lib.MediaInfo_Open.argtypes = [ctypes.c_void_p, ctypes.c_wchar_p]
+        lib.MediaInfo_Open.restype = ctypes.c_size_t
+        lib.MediaInfo_Inform.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+        lib.MediaInfo_Inform.restype = ctypes.c_wchar_p
+        lib.MediaInfo_Close.argtypes = [ctypes.c_void_p]
+        lib.MediaInfo_Close.restype = None
+        lib.MediaInfo_Delete.argtypes = [ctypes.c_void_p]
+        lib.MediaInfo_Delete.restype = None
+        log.debug('Loaded libmediainfo from {}', path)
+        return lib
+
+    raise OSError('Could not load libmediainfo: ' + '; '.join(errors))
+
+
+def get_library():
+    global _lib
+    with _lib_lock:
+        if _lib is None:
+            _lib = _load_library()
+        return _lib
+
+
+def parse(path, parse_speed=0.5, cache=True):
+    """Parses path once. Returns the text report and the tracks as dicts,
+    in the format of pymediainfo's Track.to_data(). Results are cached
+    until the file changes."""
+    mi_cache = shared(MediainfoCache) if cache else None
+    if mi_cache is None:
+        return _parse(path, parse_speed)
+    return mi_cache.memoize(_parse, path, parse_speed)
+
+
+def parse_many(paths, max_workers=None):
+    """Parses paths in parallel, results are in order. A path that could
+    not be parsed has its exception instead of a result."""
+    def parse_or_fail(path):
+        try:
+            return parse(path)
+        except (OSError, MediainfoException) as e:
+            return e
+
+    # threads, as libmediainfo releases the GIL and forking from a
+    # rendering thread could inherit locks held by other threads
+    max_workers = max(1, min(len(paths), max_workers or os.cpu_count() or 1))
+    with ThreadPoolExecutor(max_workers) as executor:
+        return list(executor.map(parse_or_fail, paths))
+
+
+def profile(tracks):
+    """What should be consistent across the episodes of a season: the
+    formats and resolution of the video, format, channels and languages of
+    the audio and the subtitle languages"""
+    def by_type(track_type, *keys):
+        return tuple(tuple(t.get(k) for k in keys) for t in tracks
+                     if t['track_type'] == track_type)
+
+    return {'video': by_type('Video', 'format', 'width', 'height'),
+            'audio': by_type('Audio', 'format', 'channel_s', 'language'),
+            'text': by_type('Text', 'language')}
+
+
+def consistency(profiles):
+    """Returns the most common profile for each kind of track and the
+    deviations from it by index of the profile"""
+    if not profiles:
+        return {}, {}
+    common = {kind: Counter(p[kind] for p in profiles).most_common(1)[0][0]
+              for kind in ('video', 'audio', 'text')}
+    outliers = {}
+    for i, p in enumerate(profiles):
+        diff = {kind: p[kind] for kind in common if p[kind] != common[kind]}
+        if diff:
+            outliers[i] = diff
+    return common, outliers
+
+
+def _parse(path, parse_speed):
+    lib = get_library()
+    handle = lib.MediaInfo_New()
+    try:
+        version = lib.MediaInfo_Option(handle, 'Info_Version', '')
+        match = re.search(r'v(\d+)\.(\d+)', version)
+        # pymediainfo parses the XML format used before 17.10
+        lib_version = tuple(map(int, match.groups())) if match else (0, 0)
+        xml_option = 'OLDXML' if lib_version >= (17, 10) else 'XML'
+
+        lib.MediaInfo_Option(handle, 'CharSet', 'UTF-8')
+        lib.MediaInfo_Option(handle, 'ParseSpeed', str(parse_speed))
+        if not lib.MediaInfo_Open(handle, path):
+            raise MediainfoException(
+                'libmediainfo could not open {}'.format(path))
+
+        try:
+            lib.MediaInfo_Option(handle, 'Complete', '')
+            lib.MediaInfo_Option(handle, 'Inform', '')
+            text = lib.MediaInfo_Inform(handle, 0)
+
+            lib.MediaInfo_Option(handle, 'Complete', '1')
+            lib.MediaInfo_Option(handle, 'Inform', xml_option)
+            xml = lib.MediaInfo_Inform(handle, 0)
+        finally:
+            lib.MediaInfo_Close(handle)
+    finally:
+        lib.MediaInfo_Delete(handle)
+
+    tracks = [track.to_data() for track in pymediainfo.MediaInfo(xml).tracks]
+    return text, tracks
@@ -1,29 +1,51 @@
 # -*- coding: utf-8 -*-
 import os
 import re
+import sys
 import copy
-import inspect
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 try:
     import readline
 except ImportError:
     import pyreadline as readline
 
 
+from . import prompt_lock
 from .logging import log
+from .cache import fingerprint
 
 
 def rlinput(prompt, prefill=''):
-    readline.set_startup_hook(lambda: readline.insert_text(prefill))
-    try:
-        return input(prompt)
-    finally:
-        readline.set_startup_hook()
+    with prompt_lock:
+        readline.set_startup_hook(lambda: readline.insert_text(prefill))
+        try:
+            return input(prompt)
+        finally:
+            readline.set_startup_hook()
 
 
 class SubmissionAttributeError(Exception):
     pass
 
 
+class WouldPrompt(Exception):
+    """Raised instead of rendering an interactive field while only checking
+    whether rendering would prompt"""
+
+
+class FinalizationError(Exception):
+    def __init__(self, failures):
+        super(FinalizationError, self).__init__(failures)
+        self.failures = failures  # field -> exception
+
+    def __str__(self):
+        return "Could not finalize {}".format(", ".join(
+            "{} ({!r})".format(f, e) for f, e in self.failures.items()))
+
+
 re_frender = re.compile("^_render_(?=[a-z_]*$)")
 cat_map = {}
 
@@ -52,7 +74,21 @@ class RegisteringType(type):
         for field, (form_field, form_field_type) in form_field_mappers.items():
             add_mapper(field, form_field, form_field_type)
 
+        # compile renderer dispatch table and static dependency graph
+        cls._renderers = dict(getattr(cls, '_renderers', {}))
+        cls._requires = dict(getattr(cls, '_requires', {}))
+        cls._interactive = dict(getattr(cls, '_interactive', {}))
+
         for key, val in attrs.items():
+            field, n = re.subn(re_frender, '', key)
+            if n == 1 and callable(val):
+                cls._renderers[field] = val
+                cls._requires[field] = frozenset(getattr(val, 'requires', ()))
+                if hasattr(val, 'interactive'):
+                    cls._interactive[field] = val.interactive
+                else:
+                    cls._interactive.pop(field, None)
+
             try:
                 form_field, form_field_type = getattr(val, 'form_field')
             except AttributeError:
@@ -68,6 +104,12 @@ class RegisteringType(type):
                 assert n == 1  # only then is it a field renderer
                 cls._to_finalize = getattr(cls, '_to_finalize', []) + [field]
 
+            # get fields that may be reused across runs
+            if getattr(val, 'persistent', False):
+                field, n = re.subn(re_frender, '', key)
+                assert n == 1  # only then is it a field renderer
+                cls._persistent = getattr(cls, '_persistent', []) + [field]
+
 
 form_field_types = {'text', 'checkbox', 'file'}  # todo select
 
@@ -84,59 +126,348 @@ def finalize(f):
     return f
 
 
-class CachedRenderer(object):
+def persistent(f):
+    f.persistent = True
+    return f
+
+
+def speculative(f):
+    """Marks a finalizer as safe to run before the user confirmed, i.e.
+    one without side effects or whose side effects are undone if its
+    result is discarded. Uploads are public as soon as they finish, so they
+    must not be speculative."""
+    f.speculative = True
+    return f
+
+
+def interactive(when=None):
+    """Marks a renderer which may prompt the user. `when` cheaply decides
+    whether rendering the field would prompt at all."""
+    def decorator(f):
+        f.interactive = when or (lambda self: True)
+        return f
+    return decorator
+
+
+def cost(reads=0, http=0, subprocesses=0):
+    """Declares what rendering or finalizing a field costs, for planning:
+    bytes read, HTTP requests made and subprocesses started. Each may also
+    be a callable which estimates it from the fields set so far."""
+    def decorator(f):
+        f.cost = {'reads': reads, 'http': http, 'subprocesses': subprocesses}
+        return f
+    return decorator
+
+
+def requires(*fields):
+    def decorator(f):
+        f.requires = fields
+        return f
+    return decorator
+
+
+MISSING = object()
+
+
+class CachedRenderer(object, metaclass=RegisteringType):
+    _persistent = []
+    _to_finalize = []
+    _cache_key_fields = ()
+
     def __init__(self, **kwargs):
         log.debug("Creating cached renderer {}", kwargs)
         self.fields = kwargs
-        self.depends_on = {}
+        self.depends_on = DependencyGraph()
+        self._local = threading.local()
+        self._field_locks = {}
+        self._field_locks_lock = threading.Lock()
+        self.field_cache = None
+        self.journal = None
+        self.timings = None
+        self.memory_budget = None  # bytes, soft limit on rendered fields
+        self._sizes = {}
+        self._evict_lock = threading.Lock()
+
+    @property
+    def _render_stack(self):
+        # (field, fields read so far) currently being rendered by this
+        # thread, innermost last
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    @property
+    def _nested_time(self):
+        # time spent rendering nested fields, per entry of the render stack
+        try:
+            return self._local.nested_time
+        except AttributeError:
+            self._local.nested_time = []
+            return self._local.nested_time
+
+    def _field_lock(self, field):
+        with self._field_locks_lock:
+            return self._field_locks.setdefault(field, threading.RLock())
 
     def __getitem__(self, field):
-        # todo: better way to track dependencies. explicit @requires decorator?
-        try:
-            # get first calling field
-            caller = next(level[3] for level in inspect.stack()
-                          if level[3].startswith('_render_'))
-        except StopIteration:
-            pass
-        else:
-            caller, n = re.subn(re_frender, '', caller, count=1)
-            if n:  # called by another cached field
-                self.depends_on[field] = self.depends_on.setdefault(
-                    field, set()) | {caller}
+        stack = self._render_stack
+        if stack:  # called by another cached field
+            caller, reads = stack[-1]
+            if field not in reads:
+                reads.append(field)
+            if self.depends_on.add(field, caller):
                 log.debug('Adding {} dependency {} -> {}',
                           type(self).__name__, caller, field)
 
         try:
             return self.fields[field]
         except KeyError:
+            pass
+
+        # only one thread renders a field, others wait for its result
+        with self._field_lock(field):
             try:
-                field_renderer = getattr(self, '_render_' + field)
-            except AttributeError:
-                raise SubmissionAttributeError(
-                    self.__class__.__name__ + " does not contain or "
-                    "has no rules to generate field '" + field + "'")
+                return self.fields[field]
+            except KeyError:
+                return self._render(field)
+
+    def _render(self, field):
+        try:
+            field_renderer = self._renderers[field]
+        except KeyError:
+            raise SubmissionAttributeError(
+                self.__class__.__name__ + " does not contain or "
+                "has no rules to generate field '" + field + "'")
+        if field in self._interactive and getattr(self._local, 'dry', False):
+            raise WouldPrompt(field)
+
+        persist = (self.field_cache is not None and
+                   field in self._persistent)
+        # dependencies are recorded anew, they may have changed since the
+        # field was last rendered
+        self.depends_on.remove_dependencies(field)
+        reads = []
+        stack = self._render_stack
+        stack.append((field, reads))
+        nested_time = self._nested_time
+        nested_time.append(0.)
+        start = time.perf_counter()
+        try:
+            rv = self._load_field(field) if persist else MISSING
+            if rv is MISSING:
+                del reads[:]
+                log.debug('Rendering field {}[\'{}\']',
+                          type(self).__name__, field)
+                rv = field_renderer(self)
+                if persist:
+                    self._store_field(field, reads, rv)
+        finally:
+            stack.pop()
+            elapsed = time.perf_counter() - start
+            nested = nested_time.pop()
+            if nested_time:
+                nested_time[-1] += elapsed
+
+        self.record_timing('render', field, elapsed - nested)
+
+        undeclared = set(reads) - self._requires[field]
+        if self._requires[field] and undeclared:
+            log.debug('{}[\'{}\'] also looked up {}',
+                      type(self).__name__, field, sorted(undeclared))
+        self.fields[field] = rv
+        self.checkpoint('render', field, rv, reads)
+        if self.memory_budget is not None:
+            self._sizes[field] = approximate_size(rv)
+            self.evict()
+        return rv
+
+    def evict(self):
+        """Drops heavy intermediate fields until the rendered fields fit into
+        the memory budget. Only persistent fields whose dependents, recorded
+        or declared with requires, have all been rendered are dropped. They
+        are rendered again or reloaded from the field cache if looked up
+        later. Interactive fields are only dropped if there is a field cache
+        to reload them from without prompting again. Returns the evicted
+        fields."""
+        with self._evict_lock:
+            return self._evict()
+
+    def _evict(self):
+        sizes = {f: size for f, size in list(self._sizes.items())
+                 if f in self.fields}
+        total = sum(sizes.values())
+        if total <= self.memory_budget:
+            return []
+
+        def evictable(f):
+            dependents = self.depends_on.dependents_of(f) | {
+                g for g, requires in self._requires.items() if f in requires}
+            return (f in self._persistent and
+                    (f not in self._interactive or
+                     self.field_cache is not None) and
+                    f not in self._to_finalize and
+                    dependents and
+                    all(d in self.fields for d in dependents))
+
+        evicted = []
+        for f in sorted(filter(evictable, sizes), key=sizes.get,
+                        reverse=True):
+            if total <= self.memory_budget:
+                break
+            self.fields.pop(f, None)
+            self._sizes.pop(f, None)
+            total -= sizes[f]
+            evicted.append(f)
+            log.debug('Evicted {}[\'{}\'] ({} bytes)',
+                      type(self).__name__, f, sizes[f])
+
+        if total > self.memory_budget:
+            log.debug('{} fields use {} bytes, over budget of {}',
+                      type(self).__name__, total, self.memory_budget)
+        return evicted
+
+    def checkpoint(self, *record):
+        """Appends record to the journal, if any. Returns False if the
+        record could not be journaled."""
+        if self.journal is None:
+            return True
+        return self.journal.append(*record)
+
+    def _timing_key(self, stage, field):
+        return '{}.{}.{}'.format(type(self).__name__, stage, field)
+
+    def record_timing(self, stage, field, seconds):
+        if self.timings is not None:
+            self.timings.record(self._timing_key(stage, field), seconds)
+
+    def estimate_timing(self, stage, field):
+        if self.timings is not None:
+            return self.timings.estimate(self._timing_key(stage, field))
+
+    def _cache_namespace(self):
+        return (type(self).__name__,) + tuple(
+            fingerprint(self.fields.get(f)) for f in self._cache_key_fields)
+
+    def _load_field(self, field):
+        entry = self.field_cache.load(self._cache_namespace(), field)
+        if entry is None:
+            return MISSING
+
+        trace, value = entry
+        for f, fp in trace:
+            # looked up from within the render context of field, so that
+            # the dependencies are recorded as if it had been rendered
+            if fingerprint(self[f]) != fp:
+                log.debug('Cached field {} is stale: {} changed', field, f)
+                return MISSING
+
+        log.debug('Using cached field {}[\'{}\']', type(self).__name__, field)
+        return value
+
+    def _store_field(self, field, reads, value):
+        try:
+            trace = [(f, fingerprint(self.fields[f])) for f in reads]
+        except KeyError:  # a field read during rendering was invalidated
+            return
+        except Exception as e:  # e.g. unpicklable input value
+            log.debug('Not caching field {}: {!r}', field, e)
+            return
+        self.field_cache.store(self._cache_namespace(), field, trace, value)
+
+    def requirements(self, field):
+        """Fields known to be looked up when rendering field, as declared by
+        @requires or recorded when it was last rendered"""
+        return (self._requires.get(field, frozenset()) |
+                self.depends_on.dependencies_of(field))
+
+    def render_order(self, fields):
+        """fields and their known requirements, requirements first"""
+        order = []
+        seen = set()
+
+        def visit(field):
+            if field in seen:
+                return
+            seen.add(field)
+            for f in sorted(self.requirements(field)):
+                visit(f)
+            order.append(field)
 
-            log.debug('Rendering field {}[\'{}\']', type(self).__name__, field)
-            rv = field_renderer()
-            self.fields[field] = rv
-            return rv
+        for field in fields:
+            visit(field)
+        return order
+
+    def render_interactive(self, fields):
+        """Render the fields which would prompt the user when rendering
+        fields, so that the remaining work can run unattended. Returns the
+        fields that were rendered."""
+        rendered = []
+        for field in self.render_order(fields):
+            when = self._interactive.get(field)
+            if when is None or field in self.fields or not when(self):
+                continue
+            log.debug('Asking for {} up front', field)
+            self[field]
+            rendered.append(field)
+        return rendered
+
+    def would_prompt(self, field):
+        """Whether rendering field would prompt the user, as far as its
+        `when` can tell without prompting itself. `when` may render cheap
+        fields it needs, but if it needs another interactive field, the
+        answer is that field may prompt."""
+        when = self._interactive.get(field)
+        if when is None or field in self.fields:
+            return False
+        self._local.dry = True
+        try:
+            return bool(when(self))
+        except Exception as e:  # e.g. WouldPrompt
+            log.debug('Assuming {} may prompt: {!r}', field, e)
+            return True
+        finally:
+            self._local.dry = False
+
+    def render_concurrently(self, fields, max_workers=None):
+        """Render fields and everything they require on a thread pool.
+
+        Known requirements are submitted first, so that independent slow
+        fields (hashing, subprocesses, HTTP requests) overlap instead of
+        running back to back. Fields which are already being rendered by
+        another thread are waited for rather than rendered twice."""
+        order = self.render_order(fields)
+        log.debug('Rendering {} concurrently: {}', type(self).__name__, order)
+        with ThreadPoolExecutor(max_workers) as executor:
+            futures = {f: executor.submit(self.__getitem__, f)
+                       for f in order if f not in self.fields}
+
+        for field, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                if field in fields:
+                    raise
+                # the requiring field re-raises it when rendered
+                log.debug('Could not prefetch {}: {!r}', field, e)
 
     def __setitem__(self, key, value):
         self.invalidate_field_cache(key)
         self.fields[key] = value
+        # only rendered values are evicted, a set value could not be
+        # rendered again
+        self._sizes.pop(key, None)
+        if not self.checkpoint('set', key, value):
+            # the value is lost on resume, but so are its dependents
+            self.checkpoint('invalidate', key)
 
     def invalidate_field_cache(self, field):
-        try:
-            dependent_fields = self.depends_on.pop(field)
-        except KeyError:
-            pass
-            self.fields.pop(field, None) and log.debug(
-                'del inval leaf {}', field)
-        else:
-            for f in dependent_fields:
-                self.invalidate_field_cache(f)
-            self.fields.pop(field, None) and log.debug(
-                'del inval node {}', field)
+        # the graph is kept, dependents re-record their edges when rendered
+        invalidated = [field] + self.depends_on.downstream(field)
+        for f in invalidated:
+            self.fields.pop(f, None) and log.debug('del inval {}', f)
+        return invalidated
 
 
 def build_payload(fd_val, form_field, fft):
@@ -162,35 +493,122 @@ def build_payload(fd_val, form_field, fft):
         raise AssertionError(form_field, fd_val)
 
 
+def approximate_size(value, _seen=None):
+    """Approximate memory used by value and everything it references"""
+    seen = set() if _seen is None else _seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+
+    size = sys.getsizeof(value)
+    if isinstance(value, (str, bytes, int, float, bool, type(None))):
+        return size
+    if isinstance(value, dict):
+        items = [v for kv in value.items() for v in kv]
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        items = value
+    elif hasattr(value, '__dict__'):
+        items = [vars(value)]
+    else:
+        items = ()
+    return size + sum(approximate_size(v, seen) for v in items)
+
+
 def toposort(depends_on):
-    depends_on = copy.deepcopy(depends_on)
-    sorted_funcs = []
-
-    depends = (set(f for v in depends_on.values() for f in v) -
-               set(depends_on.keys()))
-    for d in depends:
-        depends_on[d] = set()
-
-    ready_funcs = set(func for func, deps in depends_on.items() if not deps)
-    while ready_funcs:
-        executed = ready_funcs.pop()
-        depends_on.pop(executed)
-        sorted_funcs.append(executed)
-        from_selection = [func for func, deps in depends_on.items()
-                          if executed in deps]
-        for func in from_selection:
-            depends_on[func].remove(executed)
-            if not depends_on[func]:
-                ready_funcs.add(func)
-
-    if depends_on:
+    """Orders the nodes of depends_on such that every node comes after the
+    nodes it maps to (Kahn's algorithm)"""
+    nodes = set(depends_on).union(*depends_on.values())
+    pending = {node: len(depends_on.get(node, ())) for node in nodes}
+    successors = {}
+    for node, deps in depends_on.items():
+        for dep in deps:
+            successors.setdefault(dep, []).append(node)
+
+    sorted_nodes = []
+    ready = deque(node for node, n in pending.items() if not n)
+    while ready:
+        node = ready.popleft()
+        sorted_nodes.append(node)
+        for successor in successors.get(node, ()):
+            pending[successor] -= 1
+            if not pending[successor]:
+                ready.append(successor)
+
+    if len(sorted_nodes) != len(nodes):
         raise Exception("Cyclic dependencies present: {}".format(
-            depends_on))
-    else:
-        return sorted_funcs
+            {node: depends_on[node] for node, n in pending.items() if n}))
+    return sorted_nodes
+
+
+class DependencyGraph(object):
+    """Dependencies between fields, indexed in both directions"""
+    def __init__(self):
+        self.dependents = {}  # field -> fields which looked it up
+        self.dependencies = {}  # field -> fields it looked up
+        self._lock = threading.Lock()
+
+    def add(self, field, dependent):
+        """Records that dependent looked up field. Returns whether the
+        edge is new."""
+        if dependent in self.dependents.get(field, ()):
+            return False
+        with self._lock:
+            self.dependents.setdefault(field, set()).add(dependent)
+            self.dependencies.setdefault(dependent, set()).add(field)
+        return True
+
+    def remove_dependencies(self, field):
+        with self._lock:
+            for dep in self.dependencies.pop(field, ()):
+                dependents = self.dependents[dep]
+                dependents.discard(field)
+                if not dependents:
+                    del self.dependents[dep]
+
+    def dependents_of(self, field):
+        with self._lock:
+            return set(self.dependents.get(field, ()))
+
+    def dependencies_of(self, field):
+        with self._lock:
+            return set(self.dependencies.get(field, ()))
+
+    def _walk(self, edges, field):
+        with self._lock:
+            seen = {field}
+            found = []
+            stack = [field]
+            while stack:
+                for f in edges.get(stack.pop(), ()):
+                    if f not in seen:
+                        seen.add(f)
+                        found.append(f)
+                        stack.append(f)
+            return found
+
+    def downstream(self, field):
+        """All fields which directly or indirectly depend on field"""
+        return self._walk(self.dependents, field)
+
+    def upstream(self, field):
+        """All fields which field directly or indirectly depends on"""
+        return self._walk(self.dependencies, field)
+
+    def toposort(self):
+        """All fields in the graph, dependencies first"""
+        with self._lock:
+            return toposort(self.dependencies)
 
 
 class Submission(CachedRenderer, metaclass=RegisteringType):
+    def __init__(self, **kwargs):
+        super(Submission, self).__init__(**kwargs)
+        self.finalized = set()
+        # finalizing a field invalidates its dependents, they are still
+        # finalized if they were rendered before
+        self._finalizing = set()
+        self._speculation = None  # field -> future, None if not speculating
+
     def __repr__(self):
         return "\n".join(
             ["Field {k}:\n\t{v}\n".format(k=k, v=v)
@@ -206,24 +624,229 @@ class Submission(CachedRenderer, metaclass=RegisteringType):
     def _finalize_submit(self):
         return self.submit(self['payload'])
 
+    def requirements(self, field):
+        reqs = super(Submission, self).requirements(field)
+        if field in ('submit', 'payload'):  # all form fields
+            reqs |= set(self.registry['mappers'])
+        return reqs
+
+    def invalidate_field_cache(self, field):
+        invalidated = super(Submission, self).invalidate_field_cache(field)
+        self.finalized.difference_update(invalidated)
+        if self._speculation:
+            for f in invalidated:
+                future = self._speculation.pop(f, None)
+                if future is not None:
+                    future.cancel()
+                    log.debug('Discarding speculative finalization of {}', f)
+        return invalidated
+
+    def speculate(self):
+        """Starts speculative finalizers in the background. They only run
+        for fields that depend on no other field needing finalization, and
+        their results are used by finalize unless the field was amended."""
+        if self._speculation is None:
+            self._speculation = {}
+            self._speculation_executor = ThreadPoolExecutor()
+
+        needs_finalization = self.needs_finalization()
+        for f in needs_finalization - set(self._speculation):
+            finalizer = getattr(self, '_finalize_' + f)
+            upstream = set(self.depends_on.upstream(f)) & needs_finalization
+            if getattr(finalizer, 'speculative', False) and not upstream:
+                log.debug('Speculatively finalizing {}', f)
+                self._speculation[f] = self._speculation_executor.submit(
+                    self._run_finalizer, f)
+
+    def discard_speculation(self):
+        if self._speculation is None:
+            return
+        for f, future in self._speculation.items():
+            future.cancel()
+            log.debug('Discarding speculative finalization of {}', f)
+        self._speculation_executor.shutdown(wait=False)
+        self._speculation = None
+
     def needs_finalization(self):
-        return set(self._to_finalize) & set(self.fields.keys())
+        rendered = set(self.fields.keys()) | self._finalizing
+        return (set(self._to_finalize) & rendered) - self.finalized
 
-    def finalize(self):
+    def finalization_levels(self):
+        """Fields that need finalization, grouped such that no field
+        depends on another one of its own or a later group"""
         needs_finalization = self.needs_finalization()
-        order = toposort(self.depends_on)
-        needs_finalization = sorted(needs_finalization,
-                                    key=lambda x: order.index(x),
-                                    reverse=True)
-        for f in needs_finalization:
-            self[f] = getattr(self, '_finalize_' + f)()
+        rank = {f: i for i, f in enumerate(self.depends_on.toposort())}
+        level = {}
+        for f in sorted(needs_finalization, key=lambda f: rank.get(f, -1)):
+            upstream = set(self.depends_on.upstream(f)) & needs_finalization
+            level[f] = 1 + max((level[u] for u in upstream), default=-1)
 
-        setattr(self, 'finalized', None)
+        levels = [[] for _ in range(max(level.values(), default=-1) + 1)]
+        for f, i in level.items():
+            levels[i].append(f)
+        return levels
+
+    def finalize(self):
+        """Finalizes independent fields concurrently. Fields which were
+        finalized successfully are kept, so that calling this again after
+        a FinalizationError only retries the failed ones."""
+        levels = self.finalization_levels()
+        self._finalizing.update(*levels)
+        self.checkpoint('finalizing', set(self._finalizing))
+        speculation = self._speculation or {}
+        for fields in levels:
+            with ThreadPoolExecutor(len(fields)) as executor:
+                futures = {f: speculation.pop(f, None) or
+                           executor.submit(self._run_finalizer, f)
+                           for f in fields}
+
+            failures = {}
+            for f, future in futures.items():
+                try:
+                    value = future.result()
+                except Exception as e:
+                    log.error('Finalizing {} failed: {!r}', f, e)
+                    failures[f] = e
+                else:
+                    self[f] = value
+                    self.finalized.add(f)
+                    self.checkpoint('finalized', f)
+
+            if failures:
+                raise FinalizationError(failures)
+
+        self.discard_speculation()
+
+    def _run_finalizer(self, field):
+        start = time.perf_counter()
+        rv = getattr(self, '_finalize_' + field)()
+        self.record_timing('finalize', field, time.perf_counter() - start)
+        return rv
 
     @staticmethod
     def submit(payload):
         raise NotImplementedError
 
+    def _estimate_cost(self, f):
+        """Cost declared by @cost on renderer or finalizer f, with unknown
+        estimates as None"""
+        cost = {}
+        for kind, estimate in getattr(f, 'cost', {}).items():
+            if callable(estimate):
+                try:
+                    estimate = estimate(self.fields)
+                except Exception as e:  # e.g. a field that is not set yet
+                    log.debug('Cannot estimate {} of {}: {!r}',
+                              kind, f.__name__, e)
+                    estimate = None
+            cost[kind] = estimate
+        return cost
+
+    def plan(self, fields):
+        """The steps rendering and finalizing fields would take, in order,
+        without taking any of them. Only known requirements are followed,
+        i.e. those declared by @requires or recorded by an earlier render.
+        Interactive fields are only planned to prompt if their `when` says
+        so, which may render the cheap fields it needs."""
+        steps = []
+        order = self.render_order(fields)
+        given = {f for f in order if f in self.fields}
+        for field in order:
+            step = {'field': field,
+                    'requires': sorted(self.requirements(field)),
+                    'given': field in given,
+                    'known': field in given or field in self._renderers,
+                    'interactive': (field not in given and
+                                    self.would_prompt(field)),
+                    'finalize': field in self._to_finalize,
+                    'cost': {},
+                    'seconds': None}
+            if not step['given'] and step['known']:
+                step['cost'] = self._estimate_cost(self._renderers[field])
+                step['seconds'] = self.estimate_timing('render', field)
+            if step['finalize']:
+                finalizer = getattr(self, '_finalize_' + field)
+                step['finalize_cost'] = self._estimate_cost(finalizer)
+                step['finalize_seconds'] = self.estimate_timing(
+                    'finalize', field)
+            steps.append(step)
+        return steps
+
+    def show_plan(self, fields):
+        def format_size(size):
+            for unit in ('B', 'KiB', 'MiB', 'GiB'):
+                if size < 1024:
+                    break
+                size /= 1024
+            else:
+                unit = 'TiB'
+            return '{:.{}f} {}'.format(size, int(unit != 'B'), unit)
+
+        def format_cost(cost, seconds):
+            s = []
+            for kind, fmt in (('reads', 'reads {}'), ('http', '{} HTTP'),
+                              ('subprocesses', '{} subprocesses')):
+                value = cost.get(kind)
+                if value is None and kind in cost:
+                    s.append(fmt.format('?'))
+                elif value:
+                    if kind == 'reads':
+                        value = format_size(value)
+                    s.append(fmt.format(value))
+            if seconds is not None:
+                s.append('~{:.1f}s'.format(seconds))
+            return ", ".join(s)
+
+        steps = self.plan(fields)
+        totals = dict.fromkeys(('reads', 'http', 'subprocesses', 'seconds'),
+                               0)
+        unknown = set()
+
+        def add(cost, seconds):
+            for kind, value in list(cost.items()) + [('seconds', seconds)]:
+                if value is None:
+                    unknown.add(kind)
+                else:
+                    totals[kind] += value
+
+        s = "Plan for {}:\n".format(type(self).__name__)
+        for step in steps:
+            if step['given']:
+                what = 'given'
+            elif not step['known']:
+                what = 'no rules to render'
+            else:
+                what = 'render'
+                if step['interactive']:
+                    what += ' (may prompt)'
+                cost = format_cost(step['cost'], step['seconds'])
+                if cost:
+                    what += ': ' + cost
+                add(step['cost'], step['seconds'])
+
+            if step['finalize']:
+                what += '; finalize'
+                cost = format_cost(step['finalize_cost'],
+                                   step['finalize_seconds'])
+                if cost:
+                    what += ': ' + cost
+                add(step['finalize_cost'], step['finalize_seconds'])
+
+            s += "  {:<24} {}\n".format(step['field'], what)
+            if step['requires']:
+                s += "  {:<24} <- {}\n".format('', ", ".join(step['requires']))
+
+        s += ("Total: reads {}, {} HTTP, {} subprocesses, {} interactive, "
+              "~{:.0f}s from previous runs").format(
+                  format_size(totals['reads']), totals['http'],
+                  totals['subprocesses'],
+                  sum(1 for step in steps if step['interactive'] and
+                      not step['given']),
+                  totals['seconds'])
+        if unknown:
+            s += " (not all {} known)".format(", ".join(sorted(unknown)))
+        return s + "\n"
+
     def show_fields(self, fields):
         def format_val(val):
             if isinstance(val, str) and os.path.exists(val):
@@ -240,7 +863,7 @@ class Submission(CachedRenderer, metaclass=RegisteringType):
         for field in fields:
             val = self[field]
             field_str = field
-            if field in self._to_finalize and not hasattr(self, 'finalized'):
+            if field in self._to_finalize and field not in self.finalized:
                 field_str += " (will be finalized)"
             s += ("  " + field_str + "  ").center(consolewidth, "=") + "\n"
             s += format_val(val) + "\n"
@@ -256,14 +879,17 @@ class Submission(CachedRenderer, metaclass=RegisteringType):
         while True:
             print("Reminder: YOU are responsible for following the "
                   "submission rules!")
-            choice = input('Finalize these values? This will upload or '
-                           'submit all necessary data. [y/n] ')
+            with prompt_lock:
+                choice = input('Finalize these values? This will upload or '
+                               'submit all necessary data. [y/n] ')
 
             if not choice:
                 pass
             elif choice.lower() == 'n':
-                amend = input("Amend a field? [N/<field name>] ")
+                with prompt_lock:
+                    amend = input("Amend a field? [N/<field name>] ")
                 if not amend.lower() or amend.lower() == 'n':
+                    self.discard_speculation()
                     return False
 
                 try:
@@ -292,6 +918,8 @@ class Submission(CachedRenderer, metaclass=RegisteringType):
                         self[amend] = new_value
 
                         print(self.show_fields(fields))
+                        if self._speculation is not None:
+                            self.speculate()
 
             elif choice.lower() == 'y':
                 return True
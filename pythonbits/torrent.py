@@ -8,6 +8,7 @@ from urllib.parse import urlparse
 
 from . import _release as release
 from .config import config
+from .files import scan, total_size
 from .logging import log
 
 config.register('Torrent', 'black_hole',
@@ -37,10 +38,7 @@ def log2(x):
 
 
 def get_size(fname):
-    if os.path.isfile(fname):
-        return os.path.getsize(fname)
-    else:
-        return sum(get_size(os.path.join(fname, f)) for f in os.listdir(fname))
+    return total_size(scan(fname))
 
 
 def piece_size_exp(size):
@@ -68,8 +66,10 @@ def get_version():
             "Could not find mktorrent, please ensure it is installed.")
 
 
-def make_torrent(fname):
-    fsize = get_size(fname)
+def make_torrent(fname, fsize=None):
+    """fsize is the size of all files at fname, if already known"""
+    if fsize is None:
+        fsize = get_size(fname)
     psize_exp = piece_size_exp(fsize)
 
     announce_url = config.get('Tracker', 'announce_url')
@@ -45,6 +45,10 @@ setup(
         "musicbrainzngs~=0.7",
         "terminaltables~=3.1",
     ],
+    extras_require={
+        # scoring and analysis of screenshots
+        'screenshots': ["numpy~=1.13"],
+    },
     python_requires=">=3.5,<3.10",
     tests_require=['tox', 'pytest', 'flake8', 'pytest-logbook'],
     classifiers=[
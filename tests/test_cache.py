@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+
+import pythonbits.cache as cache
+import pythonbits.submission as submission
+
+
+class CachingSubmission(submission.Submission):
+    _cache_key_fields = ('path',)
+    renders = []
+
+    @submission.persistent
+    def _render_size(self):
+        self.renders.append('size')
+        return os.path.getsize(self['path'])
+
+    @submission.persistent
+    def _render_label(self):
+        self.renders.append('label')
+        return "{} ({} bytes)".format(self['name'], self['size'])
+
+    def _render_name(self):
+        return os.path.basename(self['path'])
+
+
+def make_submission(field_cache, path):
+    s = CachingSubmission(path=path)
+    s.field_cache = field_cache
+    return s
+
+
+def test_fingerprint(tmp_path):
+    f = tmp_path / 'media.mkv'
+    f.write_bytes(b'1234')
+    fp = cache.fingerprint(str(f))
+    assert fp == cache.fingerprint(str(f))
+    assert cache.fingerprint('some text') != cache.fingerprint('other text')
+
+    f.write_bytes(b'12345')
+    assert fp != cache.fingerprint(str(f))
+
+
+def test_field_cache(tmp_path):
+    field_cache = cache.FieldCache(str(tmp_path / 'cache.sqlite'))
+    f = tmp_path / 'media.mkv'
+    f.write_bytes(b'1234')
+
+    CachingSubmission.renders = []
+    assert make_submission(field_cache, str(f))['label'] == (
+        'media.mkv (4 bytes)')
+    assert CachingSubmission.renders == ['label', 'size']
+
+    # unchanged: nothing is rendered, dependencies are still recorded
+    CachingSubmission.renders = []
+    s = make_submission(field_cache, str(f))
+    assert s['label'] == 'media.mkv (4 bytes)'
+    assert CachingSubmission.renders == []
+    assert s.depends_on.dependents == {
+        'name': {'label'}, 'size': {'label'}, 'path': {'name', 'size'}}
+
+    # amended input field: only its dependents are rendered again
+    s = make_submission(field_cache, str(f))
+    s['name'] = 'amended.mkv'
+    assert s['label'] == 'amended.mkv (4 bytes)'
+    assert CachingSubmission.renders == ['label']
+
+    # changed media: everything is rendered again
+    CachingSubmission.renders = []
+    f.write_bytes(b'12345')
+    assert make_submission(field_cache, str(f))['label'] == (
+        'media.mkv (5 bytes)')
+    assert CachingSubmission.renders == ['label', 'size']
+
+
+def test_timings(tmp_path):
+    timings = cache.Timings(str(tmp_path / 'cache.sqlite'))
+    assert timings.estimate('Submission.render.size') is None
+    timings.record('Submission.render.size', 1.)
+    timings.record('Submission.render.size', 3.)
+    assert timings.estimate('Submission.render.size') is None
+    timings.flush()
+    assert timings.estimate('Submission.render.size') == 2.
+    timings.record('Submission.render.size', 5.)
+    timings.flush()
+    assert timings.estimate('Submission.render.size') == 3.
+
+    s = make_submission(None, __file__)
+    s.timings = timings
+    s['label']
+    timings.flush()
+    assert timings.estimate('CachingSubmission.render.size') is not None
+
+
+def test_store_eviction(tmp_path, monkeypatch):
+    store = cache.Store('test', str(tmp_path / 'cache.sqlite'), max_size=300)
+    clock = iter(range(100))
+    monkeypatch.setattr(cache.time, 'time', lambda: next(clock))
+    data = os.urandom(100)  # incompressible
+
+    store.set('a', data)
+    store.set('b', data)
+    assert store.get('a') == data  # now more recently used than b
+    store.set('c', data)
+    assert store.get('b') is None
+    assert store.get('a') == store.get('c') == data
+
+
+def test_mediainfo_cache_key(tmp_path):
+    f = tmp_path / 'media.mkv'
+    f.write_bytes(b'1234')
+    key = cache.MediainfoCache.key(str(f), 0.5)
+    assert key == cache.MediainfoCache.key(str(f), 0.5)
+    assert key != cache.MediainfoCache.key(str(f), 1)
+
+    f.write_bytes(b'12345')
+    assert key != cache.MediainfoCache.key(str(f), 0.5)
+
+
+def test_memoize_unwritable(tmp_path, monkeypatch):
+    f = tmp_path / 'media.mkv'
+    f.write_bytes(b'1234')
+    store = cache.MediainfoCache(str(tmp_path / 'cache.sqlite'))
+
+    def locked(key, value):
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(store, 'set', locked)
+    assert store.memoize(os.path.getsize, str(f)) == 4
+
+
+def test_memoize_analyses(tmp_path):
+    f = tmp_path / 'media.mkv'
+    f.write_bytes(b'1234')
+    store = cache.ProbeCache(str(tmp_path / 'cache.sqlite'))
+    assert store.memoize(os.path.getsize, str(f)) == 4
+    assert store.memoize(os.path.basename, str(f)) == 'media.mkv'
+    assert store.memoize(os.path.getsize, str(f)) == 4
+
+
+def test_field_cache_unwritable(tmp_path, monkeypatch):
+    field_cache = cache.FieldCache(str(tmp_path / 'cache.sqlite'))
+
+    def locked(key, value):
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(field_cache, 'set', locked)
+    assert make_submission(field_cache, __file__)['size'] == (
+        os.path.getsize(__file__))
@@ -1,7 +1,20 @@
 # -*- coding: utf-8 -*-
 import pythonbits.submission as submission  # noqa: E402
 import pythonbits.bb as bb  # noqa: E402
+import pythonbits.cache as cache  # noqa: E402
+import pythonbits.mediainfo as mediainfo  # noqa: E402
+import pythonbits.ffmpeg as ffmpeg  # noqa: E402
+import pythonbits.imagehosting as imagehosting  # noqa: E402
+import pythonbits.files as files  # noqa: E402
+import pythonbits.disc as disc  # noqa: E402
+import pythonbits.torrent as torrent  # noqa: E402
 import pytest  # noqa: E402
+from fractions import Fraction  # noqa: E402
+import time  # noqa: E402
+import os  # noqa: E402
+import struct  # noqa: E402
+import threading  # noqa: E402
+from concurrent.futures import ThreadPoolExecutor  # noqa: E402
 
 
 def test_attribute_logic():
@@ -13,6 +26,381 @@ def test_attribute_logic():
     assert s['title'] == 'overrides_render'
 
 
+class DependentRenderer(submission.CachedRenderer):
+    def _render_a(self):
+        return self['b'] + self['c']
+
+    def _render_b(self):
+        return self['c'] * 2
+
+    def _render_c(self):
+        return 1
+
+    def _render_d(self):
+        with ThreadPoolExecutor(4) as executor:
+            return sum(executor.map(lambda f: self[f], ['a', 'b', 'c']))
+
+
+def test_dependency_tracking():
+    r = DependentRenderer()
+    assert r['a'] == 3
+    assert r.depends_on.dependents == {'b': {'a'}, 'c': {'a', 'b'}}
+
+    # lookups from outside a renderer are not dependencies
+    r['c']
+    assert r.depends_on.dependents == {'b': {'a'}, 'c': {'a', 'b'}}
+
+
+def test_invalidation():
+    r = DependentRenderer()
+    r['a']
+    r['c'] = 2
+    assert 'a' not in r.fields and 'b' not in r.fields
+    assert r['a'] == 6
+
+    # the graph is kept intact for later amendments
+    assert r.depends_on.dependents == {'b': {'a'}, 'c': {'a', 'b'}}
+    r['c'] = 3
+    assert r['a'] == 9
+
+    r['b'] = 0
+    assert 'a' not in r.fields and r.fields['c'] == 3
+    assert r['a'] == 3
+
+
+def test_toposort():
+    graph = submission.DependencyGraph()
+    for field, dependent in [('b', 'a'), ('c', 'a'), ('c', 'b'), ('d', 'c'),
+                             ('e', 'b')]:
+        graph.add(field, dependent)
+    order = graph.toposort()
+    assert sorted(order) == ['a', 'b', 'c', 'd', 'e']
+    for field, dependents in graph.dependents.items():
+        assert all(order.index(field) < order.index(d) for d in dependents)
+    assert sorted(graph.downstream('d')) == ['a', 'b', 'c']
+    assert sorted(graph.upstream('b')) == ['c', 'd', 'e']
+
+    graph.add('a', 'd')
+    with pytest.raises(Exception):
+        graph.toposort()
+
+
+def test_dependency_tracking_threads():
+    r = DependentRenderer()
+    with ThreadPoolExecutor(4) as executor:
+        assert list(executor.map(lambda f: r[f], ['a', 'b', 'c'] * 4)) == [
+            3, 2, 1] * 4
+    assert r.depends_on.dependents == {'b': {'a'}, 'c': {'a', 'b'}}
+
+    # worker threads spawned by a renderer have their own render context
+    assert r['d'] == 6
+    assert 'd' not in set().union(*r.depends_on.dependents.values())
+
+
+class SlowRenderer(submission.CachedRenderer):
+    def __init__(self, **kwargs):
+        super(SlowRenderer, self).__init__(**kwargs)
+        self.renders = []
+
+    def _slow(self, field, value):
+        self.renders.append(field)
+        time.sleep(0.05)
+        return value
+
+    def _render_left(self):
+        return self._slow('left', 1)
+
+    def _render_right(self):
+        return self._slow('right', 2)
+
+    def _render_top(self):
+        return self['left'] + self['right']
+
+    @submission.requires('left', 'right')
+    def _render_declared_top(self):
+        return self['left'] + self['right']
+
+
+def test_render_concurrently():
+    r = SlowRenderer()
+    r.render_concurrently(['top', 'left', 'right'], max_workers=4)
+    assert r.fields['top'] == 3
+    assert sorted(r.renders) == ['left', 'right']  # single-flight
+
+    # declared requirements are started as soon as possible
+    r = SlowRenderer()
+    t = time.time()
+    r.render_concurrently(['declared_top'], max_workers=4)
+    assert time.time() - t < 0.09
+    assert r.fields['declared_top'] == 3
+    assert r.requirements('top') == set()
+    assert r.requirements('declared_top') == {'left', 'right'}
+
+    # as are requirements recorded while rendering
+    r = SlowRenderer()
+    r['top']
+    del r.fields['left'], r.fields['right'], r.fields['top']
+    t = time.time()
+    r.render_concurrently(['top'], max_workers=4)
+    assert time.time() - t < 0.09
+
+    with pytest.raises(submission.SubmissionAttributeError):
+        r.render_concurrently(['top', 'missing'])
+
+
+class FinalizingSubmission(submission.Submission):
+    def __init__(self, **kwargs):
+        super(FinalizingSubmission, self).__init__(**kwargs)
+        self.finalizations = []
+        self.fail = set()
+
+    def _slow_finalize(self, field, value):
+        self.finalizations.append(field)
+        time.sleep(0.05)
+        if field in self.fail:
+            raise ValueError(field)
+        return value
+
+    @submission.finalize
+    def _render_screens(self):
+        return 'screens'
+
+    @submission.speculative
+    def _finalize_screens(self):
+        return self._slow_finalize('screens', 'uploaded screens')
+
+    @submission.finalize
+    def _render_cover(self):
+        return 'cover'
+
+    def _finalize_cover(self):
+        return self._slow_finalize('cover', 'uploaded cover')
+
+    @submission.finalize
+    def _render_description(self):
+        return self['screens'] + ' ' + self['cover']
+
+    def _finalize_description(self):
+        return self._slow_finalize(
+            'description', self['screens'] + ' ' + self['cover'])
+
+
+def test_finalize():
+    s = FinalizingSubmission()
+    s['description']
+    levels = s.finalization_levels()
+    assert [sorted(level) for level in levels] == [
+        ['cover', 'screens'], ['description']]
+
+    # independent finalizers run concurrently, successful ones are kept
+    s.fail = {'cover'}
+    t = time.time()
+    with pytest.raises(submission.FinalizationError) as e:
+        s.finalize()
+    assert time.time() - t < 0.09
+    assert set(e.value.failures) == {'cover'}
+    assert s.finalized == {'screens'}
+    assert s.fields['screens'] == 'uploaded screens'
+
+    # retrying only redoes what failed
+    s.fail = set()
+    s.finalizations = []
+    s.finalize()
+    assert s.finalizations == ['cover', 'description']
+    assert s['description'] == 'uploaded screens uploaded cover'
+    assert not s.needs_finalization()
+
+    # amending a field requires finalizing it and its dependents again
+    s['cover'] = 'other cover'
+    assert s.needs_finalization() == {'cover', 'description'}
+
+
+def test_speculative_finalization():
+    s = FinalizingSubmission()
+    s['description']
+    s.speculate()
+    assert set(s._speculation) == {'screens'}  # cover is not speculative
+    s._speculation['screens'].result()
+
+    # amending discards the speculative result
+    s['screens'] = 'amended screens'
+    assert not s._speculation
+    assert s['description'] == 'amended screens cover'
+    s.speculate()
+    s._speculation['screens'].result()
+
+    s.finalizations = []
+    s.finalize()
+    assert s.finalizations == ['cover', 'description']
+    assert s['description'] == 'uploaded screens uploaded cover'
+    assert s._speculation is None
+
+    # uploads cannot be taken back, so they wait for confirmation
+    for finalizer in (bb.VideoSubmission._finalize_screenshots,
+                      bb.VideoSubmission._finalize_cover,
+                      bb.MusicSubmission._finalize_cover):
+        assert not getattr(finalizer, 'speculative', False)
+
+
+class PromptingRenderer(submission.CachedRenderer):
+    def _render_hash(self):
+        raise AssertionError('heavy work should not start')
+
+    @submission.interactive()
+    @submission.requires('name')
+    def _render_source(self):
+        return 'WEB-DL'
+
+    @submission.interactive(when=lambda self: '2018' not in self['name'])
+    @submission.requires('name')
+    def _render_year(self):
+        return 2019
+
+    @submission.requires('hash', 'source', 'year')
+    def _render_description(self):
+        return self['hash']
+
+
+def test_render_interactive():
+    r = PromptingRenderer(name='some.movie.2018.mkv')
+    assert r.render_interactive(['description']) == ['source']
+    assert set(r.fields) == {'name', 'source'}
+
+    r = PromptingRenderer(name='some.movie.mkv')
+    assert r.render_interactive(['description']) == ['source', 'year']
+
+
+class HeavyRenderer(submission.CachedRenderer):
+    renders = prompts = 0
+
+    @submission.persistent
+    def _render_tracks(self):
+        HeavyRenderer.renders += 1
+        return {'video': ['x' * 10000], 'audio': ['y' * 10000]}
+
+    @submission.requires('tracks')
+    def _render_codec(self):
+        return self['tracks']['video'][0][:1]
+
+    @submission.requires('tracks')
+    def _render_language(self):
+        return self['tracks']['audio'][0][:1]
+
+    def _render_padding(self):
+        return 'z' * 20000
+
+    @submission.persistent
+    @submission.interactive()
+    def _render_summary(self):
+        HeavyRenderer.prompts += 1
+        return {'plot': 'p' * 10000}
+
+    @submission.requires('summary')
+    def _render_plot(self):
+        return self['summary']['plot'][:1]
+
+
+def test_memory_budget(tmp_path):
+    assert submission.approximate_size(['x' * 1000]) > 1000
+
+    HeavyRenderer.renders = 0
+    r = HeavyRenderer()
+    r.memory_budget = 1000
+    assert r['tracks']
+    assert 'tracks' in r.fields  # nothing depends on it yet
+
+    r = HeavyRenderer()
+    r.memory_budget = 1000
+    assert r['codec'] == 'x'
+    assert 'tracks' in r.fields  # language requires it too
+    assert r['language'] == 'y'
+    assert 'tracks' not in r.fields  # all its dependents are rendered
+    assert HeavyRenderer.renders == 2
+
+    # evicted fields are rendered again when needed
+    assert r['tracks']
+    assert HeavyRenderer.renders == 3
+
+    # interactive fields are only evicted if they can be reloaded
+    HeavyRenderer.prompts = 0
+    r = HeavyRenderer()
+    r.memory_budget = 1000
+    r['plot']
+    assert 'summary' in r.fields
+
+    r = HeavyRenderer()
+    r.memory_budget = 1000
+    r.field_cache = cache.FieldCache(str(tmp_path / 'cache.sqlite'))
+    r['plot']
+    assert 'summary' not in r.fields
+    assert r['summary']['plot'][:1] == 'p'
+    assert HeavyRenderer.prompts == 2
+
+    r = HeavyRenderer()
+    r.memory_budget = 100000
+    r['codec']
+    assert 'tracks' in r.fields
+
+    # amended values are never evicted
+    r = HeavyRenderer()
+    r.memory_budget = 30000
+    r['codec']
+    r['tracks'] = {'video': ['a' * 10000], 'audio': ['b' * 10000]}
+    assert r['codec'] == 'a'
+    r['padding']
+    assert 'tracks' in r.fields
+    assert r['language'] == 'b'
+
+
+class PlannedSubmission(submission.Submission):
+    @submission.cost(reads=lambda fields: len(fields['path']))
+    def _render_checksum(self):
+        raise AssertionError('planning should not render')
+
+    @submission.finalize
+    @submission.requires('checksum')
+    @submission.cost(subprocesses=1)
+    def _render_torrent(self):
+        raise AssertionError('planning should not render')
+
+    @submission.cost(http=lambda fields: fields['num_uploads'])
+    def _finalize_torrent(self):
+        raise AssertionError('planning should not finalize')
+
+    @submission.interactive(when=lambda self: not self['path'].isdigit())
+    def _render_resolution(self):
+        raise AssertionError('planning should not prompt')
+
+    @submission.interactive()
+    def _render_source(self):
+        raise AssertionError('planning should not prompt')
+
+    @submission.interactive(when=lambda self: self['source'] == 'WEB')
+    def _render_edition(self):
+        raise AssertionError('planning should not prompt')
+
+
+def test_plan():
+    s = PlannedSubmission(path='12345')
+    steps = s.plan(['torrent'])
+    assert [step['field'] for step in steps] == ['checksum', 'torrent']
+    assert steps[0]['cost'] == {'reads': 5, 'http': 0, 'subprocesses': 0}
+    assert steps[1]['requires'] == ['checksum']
+    assert steps[1]['finalize_cost']['http'] is None  # num_uploads not set
+
+    plan = s.show_plan(['torrent'])
+    assert 'reads 5 B' in plan
+    assert 'not all http' in plan
+
+    # a cheap `when` decides whether a field would prompt, one that needs
+    # another interactive field only says that it may
+    steps = s.plan(['resolution', 'source', 'edition'])
+    assert {step['field']: step['interactive'] for step in steps} == {
+        'resolution': False, 'source': True, 'edition': True}
+    assert '2 interactive' in s.show_plan(['resolution', 'source', 'edition'])
+    assert set(s.fields) == {'path'}
+
+
 # title, path, correct_specifier
 tv_names = [(None, 'some.series.s02e11.avi', ('some series', 2, 11)),
             (None, 'another series s04e02.mkv', ('another series', 4, 2)),
@@ -37,6 +425,16 @@ def test_tv_specifier(title, path, specifier):
     assert s['tv_specifier'] == specifier
 
 
+@pytest.mark.parametrize("fname,category", [
+    ('some.series.s02e11.mkv', bb.EpisodeSubmission),
+    ('Some.Movie.2018.1080p.BluRay.x264-GRP.mkv', bb.MovieSubmission)])
+def test_resolve_category(tmp_path, fname, category):
+    path = tmp_path / fname
+    path.write_bytes(b'')
+    s = bb.BbSubmission(path=str(path), title_arg=None)
+    assert type(s.resolve_category()) is category
+
+
 def test_proper():
     tracks = {'general': "",
               'video': dict(),
@@ -70,3 +468,335 @@ def test_normalise_tags(input, correct):
 def test_unicode():
     s = submission.Submission(somefield="卧虎藏龙")
     s.show_fields(('somefield',))
+
+
+def test_season_consistency():
+    def tracks(video_format, *audio_languages):
+        return ([{'track_type': 'General'},
+                 {'track_type': 'Video', 'format': video_format,
+                  'width': 1920, 'height': 1080}] +
+                [{'track_type': 'Audio', 'format': 'AAC', 'channel_s': 2,
+                  'language': lang} for lang in audio_languages])
+
+    profiles = [mediainfo.profile(t) for t in (
+        tracks('AVC', 'en'), tracks('AVC', 'en'), tracks('HEVC', 'en'),
+        tracks('AVC', 'en', 'de'))]
+    common, outliers = mediainfo.consistency(profiles)
+    assert common['video'] == (('AVC', 1920, 1080),)
+    assert outliers == {2: {'video': (('HEVC', 1920, 1080),)},
+                        3: {'audio': (('AAC', 2, 'en'), ('AAC', 2, 'de'))}}
+    assert mediainfo.consistency([]) == ({}, {})
+
+
+class MediainfoLibrary(object):
+    """Stands in for libmediainfo, recording the options set"""
+    xml = ('<Mediainfo><File>'
+           '<track type="General"><Format>Matroska</Format></track>'
+           '<track type="Video"><Format>AVC</Format></track>'
+           '</File></Mediainfo>')
+
+    def __init__(self, version):
+        self.version = version
+        self.calls = []
+        self.inform = None
+
+    def MediaInfo_New(self):
+        return 'handle'
+
+    def MediaInfo_Option(self, handle, option, value):
+        self.calls.append((option, value))
+        if option == 'Inform':
+            self.inform = value
+        return self.version if option == 'Info_Version' else ''
+
+    def MediaInfo_Open(self, handle, path):
+        self.calls.append(('Open', path))
+        return path != 'missing.mkv'
+
+    def MediaInfo_Inform(self, handle, reserved):
+        return 'General\nFormat : Matroska' if not self.inform else self.xml
+
+    def MediaInfo_Close(self, handle):
+        self.calls.append(('Close',))
+
+    def MediaInfo_Delete(self, handle):
+        self.calls.append(('Delete',))
+
+
+def test_parse_mediainfo(monkeypatch):
+    lib = MediainfoLibrary('MediaInfoLib - v18.05')
+    monkeypatch.setattr(mediainfo, 'get_library', lambda: lib)
+    text, tracks = mediainfo._parse('movie.mkv', 0.5)
+    assert text == 'General\nFormat : Matroska'
+    assert tracks == [{'track_type': 'General', 'format': 'Matroska'},
+                      {'track_type': 'Video', 'format': 'AVC'}]
+    assert lib.calls == [
+        ('Info_Version', ''), ('CharSet', 'UTF-8'), ('ParseSpeed', '0.5'),
+        ('Open', 'movie.mkv'),
+        ('Complete', ''), ('Inform', ''),
+        ('Complete', '1'), ('Inform', 'OLDXML'),
+        ('Close',), ('Delete',)]
+
+    # the XML format was renamed to OLDXML in 17.10
+    lib = MediainfoLibrary('MediaInfoLib - v17.09')
+    mediainfo._parse('movie.mkv', 0.5)
+    assert ('Inform', 'XML') in lib.calls
+
+    lib = MediainfoLibrary('MediaInfoLib - v18.05')
+    with pytest.raises(mediainfo.MediainfoException):
+        mediainfo._parse('missing.mkv', 0.5)
+    assert lib.calls[-1] == ('Delete',)
+    assert ('Close',) not in lib.calls
+
+
+def test_season_unreadable_episode(tmp_path, monkeypatch):
+    def parse(path):
+        if path.endswith('e02.mkv'):
+            raise mediainfo.MediainfoException('cannot open')
+        return 'text', [{'track_type': 'Video', 'format': 'AVC',
+                         'width': 1920, 'height': 1080}]
+
+    monkeypatch.setattr(mediainfo, 'parse', parse)
+    paths = [str(tmp_path / 'e0{}.mkv'.format(i)) for i in (1, 2, 3)]
+    assert isinstance(mediainfo.parse_many(paths)[1],
+                      mediainfo.MediainfoException)
+
+    s = bb.SeasonSubmission(path=str(tmp_path), episode_files=paths[1:])
+    assert s['mediainfo_path'] == paths[2]
+    assert 'e02.mkv: could not be parsed' in s['season_report']
+
+
+def test_probe():
+    info = {'format': {'duration': 'N/A'},
+            'streams': [
+                {'codec_type': 'video', 'width': 600, 'height': 600,
+                 'disposition': {'attached_pic': 1}},
+                {'codec_type': 'video', 'width': 720, 'height': 480,
+                 'sample_aspect_ratio': '32:27', 'field_order': 'tt',
+                 'duration': '1312.4'},
+                {'codec_type': 'audio', 'duration': '1312.5'}]}
+    stream = ffmpeg.video_stream(info)
+    assert stream['width'] == 720
+    assert ffmpeg.duration(info) == 1312.5
+    assert ffmpeg.aspect_ratios(stream) == (Fraction(32, 27),
+                                            Fraction(16, 9))
+    assert bb.VideoSubmission.probed_resolution(stream) == '480i'
+    assert bb.VideoSubmission.probed_resolution(
+        {'width': 1920, 'height': 800}) == '1080p'
+
+    assert ffmpeg.nearest_keyframe(11, [0, 10, 20]) == 10
+    assert ffmpeg.nearest_keyframe(16, [0, 10, 20]) == 20
+    assert ffmpeg.nearest_keyframe(30, [0, 10, 20]) == 20
+    assert ffmpeg.nearest_keyframe(11, []) == 11
+
+
+def test_keyframes_cost(tmp_path):
+    video = tmp_path / 'Movie' / 'movie.mkv'
+    video.parent.mkdir()
+    video.write_bytes(b'x' * 100)
+    s = bb.VideoSubmission(path=str(video.parent), mediainfo_path=str(video),
+                           options={'keyframe_screenshots': True})
+    step, = [step for step in s.plan(['keyframes'])
+             if step['field'] == 'keyframes']
+    assert step['cost']['reads'] == 100
+
+
+def test_resolution_asked_up_front(monkeypatch):
+    s = bb.VideoSubmission(path='/media/Movie.2018.1080p.mkv')
+    assert s.render_interactive(['resolution']) == []
+    assert s['resolution'] == '1080p'
+
+    s = bb.VideoSubmission(path='/media/Movie.2018.mkv')
+    monkeypatch.setattr(bb.shutil, 'which', lambda cmd: '/bin/' + cmd)
+    assert s.render_interactive(['resolution']) == []
+    assert 'probe' not in s.fields
+    monkeypatch.setattr(bb.shutil, 'which', lambda cmd: None)
+    assert s._interactive['resolution'](s)
+
+
+def test_screenshot_candidates(tmp_path):
+    numpy = pytest.importorskip('numpy')
+    rng = numpy.random.RandomState(0)
+    black = numpy.full((36, 64), 4, numpy.uint8)
+    blurred = numpy.repeat(numpy.repeat(
+        rng.randint(16, 240, (9, 16)), 4, 0), 4, 1).astype(numpy.uint8)
+    sharp = rng.randint(16, 240, (36, 64)).astype(numpy.uint8)
+
+    assert ffmpeg.frame_score(black) == 0
+    assert ffmpeg.frame_score(sharp) > ffmpeg.frame_score(blurred) > 0
+
+    burst = tmp_path / 'candidates.gray'
+    burst.write_bytes(b''.join(f.tobytes() for f in (black, blurred, sharp)))
+    assert ffmpeg.best_candidate(str(burst), 64, 36) == 2
+
+
+def test_choose_screenshot_times():
+    numpy = pytest.importorskip('numpy')
+    times = numpy.arange(100.)
+    means = numpy.full(100, 100.)
+    means[:3] = 0  # fade in
+    means[80:] = 10  # end credits
+    means[30:40] = 0  # black scene
+    stds = numpy.full(100, 30.)
+    stds[21] = stds[60] = 50  # most contrast, but 60 is a scene change
+    changes = numpy.zeros(100)
+    changes[60] = 80
+
+    chosen = ffmpeg.choose_times(times, means, stds, changes, num=3)
+    assert len(chosen) == 3
+    assert chosen[0] == 21
+    assert all(5 <= t < 80 and not 30 <= t < 40 for t in chosen)
+    assert 60 not in chosen
+
+    # too short to choose from, the fixed stops are used
+    for n in range(4):
+        assert ffmpeg.choose_times(times[:n], means[:n], stds[:n],
+                                   changes[:n], num=4) is None
+
+
+def test_upload_stream():
+    class Uploader(object):
+        in_flight = max_in_flight = done = 0
+        lock = threading.Lock()
+
+        def upload(self, *images):
+            with self.lock:
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            time.sleep(0.01 * (len(images[0]) % 3))
+            with self.lock:
+                self.in_flight -= 1
+                self.done += 1
+            for image in images:
+                yield 'https://host/' + image
+
+    uploader = Uploader()
+    images = ['screen{}.png'.format('x' * i) for i in range(10)]
+    ahead = []
+
+    def produce():
+        for i, image in enumerate(images):
+            ahead.append(i - uploader.done)
+            yield image
+
+    urls = imagehosting.upload_stream(produce(), max_in_flight=3,
+                                      uploader=uploader)
+    assert urls == ['https://host/' + image for image in images]
+    assert 1 < uploader.max_in_flight <= 3
+    # an image is only produced once an upload slot is free
+    assert max(ahead) <= 2
+
+
+def test_dhash():
+    numpy = pytest.importorskip('numpy')
+    gradient = numpy.tile(numpy.arange(9, dtype=numpy.uint8) * 20, (8, 1))
+    assert ffmpeg.dhash(gradient) == 2**64 - 1
+    assert ffmpeg.dhash(gradient[:, ::-1]) == 0
+
+    noisy = gradient.copy()
+    noisy[0, 1] = 0  # no longer brighter than its left neighbour
+    assert ffmpeg.hamming(ffmpeg.dhash(gradient), ffmpeg.dhash(noisy)) == 1
+
+
+def test_contact_sheet_tiling():
+    numpy = pytest.importorskip('numpy')
+    frames = [numpy.full((2, 3, 3), i + 1, numpy.uint8) for i in range(5)]
+    sheet = ffmpeg.tile(iter(frames), 6, 4, 2, 3, padding=1)
+    assert sheet.shape == (2 * 3 + 1, 4 * 4 + 1, 3)
+    assert (sheet[1:3, 1:4] == 1).all()
+    assert (sheet[1:3, 13:16] == 4).all()
+    assert (sheet[4:6, 1:4] == 5).all()
+    assert not sheet[4:6, 5:].any()  # fewer frames than thumbnails
+    assert not sheet[0].any() and not sheet[:, 4].any()
+
+
+def test_scan_files(tmp_path):
+    (tmp_path / 'Sample').mkdir()
+    (tmp_path / 'Sample' / 'sample.mkv').write_bytes(b'x' * 10)
+    (tmp_path / 'movie.mkv').write_bytes(b'x' * 100)
+    (tmp_path / 'movie.nfo').write_bytes(b'x')
+    (tmp_path / 'link').symlink_to(tmp_path / 'Sample')
+
+    index = files.scan(str(tmp_path))
+    assert [os.path.relpath(f.path, str(tmp_path)) for f in index] == [
+        os.path.join('Sample', 'sample.mkv'), 'movie.mkv', 'movie.nfo']
+    assert [f.size for f in files.of_type(index, 'video', 10)] == [100]
+    assert files.total_size(index) == torrent.get_size(str(tmp_path)) == 111
+    assert files.scan(index[1].path) == [index[1]]
+
+
+def mpls(*items):
+    """A Blu-ray playlist of (clip, seconds) play items"""
+    playlist = b''.join(
+        struct.pack('>H5s4sHBII', 20, clip.encode(), b'M2TS', 0, 0,
+                    0, int(seconds * disc.BD_TICKS))
+        for clip, seconds in items)
+    header = struct.pack('>IHHH', 6 + len(playlist), 0, len(items), 0)
+    return b'MPLS0200' + struct.pack('>III', 20, 0, 0) + header + playlist
+
+
+def vts_ifo(*durations):
+    """A DVD title set of program chains with BCD (h, m, s) durations"""
+    pgci = struct.pack('>HHI', len(durations), 0, 0)
+    pgci += b''.join(struct.pack('>II', 0, 8 + 8 * len(durations) + 8 * i)
+                     for i in range(len(durations)))
+    pgci += b''.join(bytes([0, 0, 1, 1, h, m, s, 0xc0]) for h, m, s in
+                     durations)
+    header = b'DVDVIDEO-VTS'.ljust(0xcc, b'\0') + struct.pack('>I', 1)
+    return header.ljust(disc.DVD_SECTOR, b'\0') + pgci
+
+
+def test_main_feature(tmp_path):
+    bdmv = tmp_path / 'Movie.2018.1080p.BluRay' / 'BDMV'
+    (bdmv / 'PLAYLIST').mkdir(parents=True)
+    (bdmv / 'STREAM').mkdir()
+    for clip, size in (('00001', 100), ('00002', 300), ('00003', 10)):
+        (bdmv / 'STREAM' / (clip + '.m2ts')).write_bytes(b'x' * size)
+    (bdmv / 'PLAYLIST' / '00000.mpls').write_bytes(
+        mpls(('00001', 1500), ('00002', 4000), ('00001', 1500)))
+    (bdmv / 'PLAYLIST' / '00001.mpls').write_bytes(mpls(('00003', 60)))
+    # refers to a clip that is not there
+    (bdmv / 'PLAYLIST' / '00002.mpls').write_bytes(mpls(('00004', 9000)))
+
+    feature = disc.main_feature(files.scan(str(tmp_path)))
+    assert feature.index == str(bdmv / 'PLAYLIST' / '00000.mpls')
+    assert feature.duration == 7000
+    assert feature.clips == [str(bdmv / 'STREAM' / '00001.m2ts'),
+                             str(bdmv / 'STREAM' / '00002.m2ts')]
+
+    s = bb.VideoSubmission(path=str(tmp_path))
+    assert s['mediainfo_path'] == str(bdmv / 'STREAM' / '00002.m2ts')
+    assert s.render_interactive(['mediainfo_path']) == []
+
+    video_ts = tmp_path / 'VIDEO_TS'
+    video_ts.mkdir()
+    (video_ts / 'VTS_01_0.IFO').write_bytes(vts_ifo((0x00, 0x05, 0x00)))
+    (video_ts / 'VTS_02_0.IFO').write_bytes(
+        vts_ifo((0x00, 0x02, 0x00), (0x02, 0x10, 0x30)))
+    for vob in ('VTS_01_1', 'VTS_02_0', 'VTS_02_1', 'VTS_02_2'):
+        (video_ts / (vob + '.VOB')).write_bytes(b'x')
+
+    feature = disc.main_feature(files.scan(str(video_ts)))
+    assert feature.kind == 'VIDEO_TS'
+    assert feature.duration == 2 * 3600 + 10 * 60 + 30
+    assert feature.clips == [str(video_ts / 'VTS_02_1.VOB'),
+                             str(video_ts / 'VTS_02_2.VOB')]
+    assert disc.main_feature(files.scan(str(tmp_path / 'VIDEO_TS' /
+                                            'VTS_01_1.VOB'))) is None
+
+
+def test_main_feature_case(tmp_path):
+    bdmv = tmp_path / 'bdmv'
+    (bdmv / 'playlist').mkdir(parents=True)
+    (bdmv / 'stream').mkdir()
+    (bdmv / 'stream' / '00001.M2TS').write_bytes(b'x')
+    (bdmv / 'playlist' / '00000.mpls').write_bytes(mpls(('00001', 60)))
+    assert disc.main_feature(files.scan(str(tmp_path))).clips == [
+        str(bdmv / 'stream' / '00001.M2TS')]
+
+    video_ts = tmp_path / 'video_ts'
+    video_ts.mkdir()
+    (video_ts / 'vts_01_0.ifo').write_bytes(vts_ifo((0x03, 0x00, 0x00)))
+    (video_ts / 'VTS_01_1.VOB').write_bytes(b'x')
+    assert disc.main_feature(files.scan(str(video_ts))).clips == [
+        str(video_ts / 'VTS_01_1.VOB')]
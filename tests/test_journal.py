@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+import pythonbits.cache as cache
+import pythonbits.journal as journal
+import pythonbits.submission as submission
+
+
+class UploadingSubmission(submission.Submission):
+    fail = False
+
+    def _render_name(self):
+        return self['path'].upper()
+
+    @submission.finalize
+    def _render_image(self):
+        return self['name'] + '.png'
+
+    def _finalize_image(self):
+        return 'https://host/' + self['image']
+
+    @submission.finalize
+    def _render_torrent(self):
+        return self['name'] + '.torrent'
+
+    def _finalize_torrent(self):
+        if self.fail:
+            raise IOError('tracker is down')
+        return self['torrent']
+
+
+def start(j, **fields):
+    s = UploadingSubmission(**fields)
+    s.journal = j
+    s.checkpoint('start', UploadingSubmission, fields,
+                 cache.fingerprint(fields['path']))
+    return s
+
+
+def test_resume(tmp_path):
+    j = journal.Journal(str(tmp_path / 'test.journal'))
+    s = start(j, path='media')
+    s['image'], s['torrent']
+    s['name'] = 'AMENDED'
+    s['image'], s['torrent']
+    s.fail = True
+    with pytest.raises(submission.FinalizationError):
+        s.finalize()
+
+    r = journal.resume(journal.Journal(j.path))
+    assert type(r) is UploadingSubmission
+    assert r.fields == s.fields
+    assert r.finalized == {'image'}
+    assert r.needs_finalization() == {'torrent'}
+    assert r.depends_on.dependents == s.depends_on.dependents
+
+    # the resumed submission keeps journaling
+    r.finalize()
+    assert journal.resume(journal.Journal(j.path)).finalized == {
+        'image', 'torrent'}
+
+
+def test_torn_record(tmp_path):
+    j = journal.Journal(str(tmp_path / 'test.journal'))
+    s = start(j, path='media')
+    s['name']
+    size = len(j.records())
+
+    s['image']
+    with open(j.path, 'r+b') as f:  # crash in the middle of a write
+        f.truncate(f.seek(0, 2) - 3)
+    torn = os.path.getsize(j.path)
+
+    # reading leaves the journal alone, appending drops the torn record
+    assert len(j.records()) == size
+    assert os.path.getsize(j.path) == torn
+    r = journal.resume(journal.Journal(j.path))
+    assert r.fields == {'path': 'media', 'name': 'MEDIA'}
+    r['image']
+    assert len(j.records()) == size + 1
+
+    j.clear()
+    assert journal.resume(j) is None
+
+
+def test_changed_media(tmp_path):
+    media = tmp_path / 'media.mkv'
+    media.write_bytes(b'1234')
+    j = journal.Journal(str(tmp_path / 'test.journal'))
+    start(j, path=str(media))['name']
+    assert journal.resume(j).fields['name'] == str(media).upper()
+
+    media.write_bytes(b'12345')
+    assert journal.resume(j) is None
+
+
+def test_short_write(tmp_path, monkeypatch):
+    j = journal.Journal(str(tmp_path / 'test.journal'))
+    s = start(j, path='media')
+    write = os.write
+    writes = []
+
+    def short_write(fd, data):
+        writes.append(len(data))
+        if len(writes) in (1, 3):
+            return write(fd, data[:5])
+        if len(writes) == 4:
+            raise OSError(28, 'No space left on device')
+        return write(fd, data)
+
+    monkeypatch.setattr(journal.os, 'write', short_write)
+    s['name']  # written in two parts
+    s['image']  # fails, leaving a torn record behind
+    s['torrent']
+    assert len(writes) == 5
+    assert [r[:2] for r in j.records()] == [
+        ('start', UploadingSubmission), ('render', 'name'),
+        ('render', 'torrent')]